@@ -0,0 +1,264 @@
+import hmac
+import json
+from datetime import date
+from functools import wraps
+from itertools import islice
+
+from flask import Blueprint, current_app, request
+from sqlalchemy import select, tuple_
+
+from database import primary_reads, read_replica
+from rate_limit import charge_rate_limit, check_rate_limit
+from models import db, CheckupRecord, MedicalProfile
+from profile_search import SEARCH_FIELDS, search_statement, search_terms
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the standard library encoder
+    orjson = None
+
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+MAX_LOOKUP_USERNAMES = 1000
+LOOKUP_CHUNK_SIZE = 500
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DEFAULT_HISTORY_PAGE_SIZE = 20
+
+
+def _json(payload, status=200):
+    """Build a JSON response with the fastest available encoder"""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, separators=(',', ':'))
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+
+@api.before_request
+def _rate_limit():
+    check_rate_limit('api')
+    if 'username' in (request.view_args or {}):
+        # Same anti-enumeration budget as profile scans, see rate_limit.rate_limit
+        check_rate_limit('miss', cost=0, required=1)
+
+
+@api.after_request
+def _charge_misses(response):
+    if response.status_code == 404 and 'username' in (request.view_args or {}):
+        charge_rate_limit('miss')
+    return response
+
+
+@api.errorhandler(429)
+def _rate_limited(error):
+    response = _json({'error': 'rate limit exceeded', 'retry_after': error.retry_after}, 429)
+    response.retry_after = error.retry_after
+    return response
+
+
+def require_api_token(view):
+    """Require a bearer token matching API_TOKEN
+
+    Fails closed: without a configured token every guarded route answers 503.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get("API_TOKEN")
+        if not token:
+            return _json({'error': 'API_TOKEN is not configured'}, 503)
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            return _json({'error': 'unauthorized'}, 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _requested_fields(*required):
+    """Parse the ?fields= parameter into a tuple of serialized column names
+
+    Returns None when the parameter names an unknown column.
+    """
+    value = request.args.get('fields')
+    if not value:
+        return MedicalProfile.SERIALIZED_FIELDS
+    wanted = {field.strip() for field in value.split(',') if field.strip()}
+    if not wanted <= set(MedicalProfile.SERIALIZED_FIELDS):
+        return None
+    wanted.update(required)
+    # Keep the model's column order so responses are stable
+    return tuple(field for field in MedicalProfile.SERIALIZED_FIELDS if field in wanted)
+
+
+def _select(fields):
+    """Select only the given columns as plain rows, skipping ORM object loading"""
+    return select(*(getattr(MedicalProfile, field) for field in fields))
+
+
+@api.route('/profiles/<username>')
+@require_api_token
+@read_replica
+def get_profile(username):
+    """Return one profile"""
+    fields = _requested_fields()
+    if fields is None:
+        return _json({'error': 'unknown field'}, 400)
+
+    profile_cache = current_app.extensions['profile_cache']
+    if fields == MedicalProfile.SERIALIZED_FIELDS:
+        data = profile_cache.get(username)
+        if data is not None:
+            return _json(data)
+
+    # A full profile fills the shared cache, so it is read from the primary
+    with primary_reads(fields == MedicalProfile.SERIALIZED_FIELDS and profile_cache.stores):
+        row = db.session.execute(_select(fields).where(MedicalProfile.username == username)).first()
+    if row is None:
+        return _json({'error': 'not found'}, 404)
+
+    data = MedicalProfile.serialize(row, fields)
+    if fields == MedicalProfile.SERIALIZED_FIELDS:
+        profile_cache.set(username, data)
+    return _json(data)
+
+
+@api.route('/profiles/search')
+@require_api_token
+@read_replica
+def search_profiles():
+    """Find profiles whose name, allergy or condition match every search term"""
+    fields = _requested_fields('id')
+    if fields is None:
+        return _json({'error': 'unknown field'}, 400)
+    terms = search_terms(request.args.get('q', ''))
+    if not terms:
+        return _json({'error': 'q must contain at least one word'}, 400)
+    field = request.args.get('field') or None
+    if field is not None and field not in SEARCH_FIELDS:
+        return _json({'error': f"field must be one of {', '.join(SEARCH_FIELDS)}"}, 400)
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+    dialect = db.session.get_bind(clause=MedicalProfile.__table__).dialect.name
+    stmt = search_statement(_select(fields), dialect, terms, field, after, limit)
+    profiles = [MedicalProfile.serialize(row, fields) for row in db.session.execute(stmt)]
+
+    return _json({
+        'profiles': profiles,
+        'next_after': profiles[-1]['id'] if len(profiles) == limit else None,
+    })
+
+
+@api.route('/profiles/lookup', methods=['GET', 'POST'])
+@require_api_token
+@read_replica
+def lookup_profiles():
+    """Return many profiles by username with one IN query per chunk"""
+    fields = _requested_fields('username')
+    if fields is None:
+        return _json({'error': 'unknown field'}, 400)
+
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        usernames = payload.get('usernames')
+        if not isinstance(usernames, list) or not all(isinstance(u, str) for u in usernames):
+            return _json({'error': 'usernames must be a list of strings'}, 400)
+    else:
+        usernames = request.args.getlist('username')
+    usernames = list(dict.fromkeys(usernames))
+    if len(usernames) > MAX_LOOKUP_USERNAMES:
+        return _json({'error': f'at most {MAX_LOOKUP_USERNAMES} usernames per request'}, 400)
+
+    profiles = []
+    remaining = iter(usernames)
+    while chunk := list(islice(remaining, LOOKUP_CHUNK_SIZE)):
+        rows = db.session.execute(_select(fields).where(MedicalProfile.username.in_(chunk)))
+        profiles.extend(MedicalProfile.serialize(row, fields) for row in rows)
+
+    found = {profile['username'] for profile in profiles}
+    return _json({
+        'profiles': profiles,
+        'missing': [username for username in usernames if username not in found],
+    })
+
+
+@api.route('/profiles')
+@require_api_token
+@read_replica
+def list_profiles():
+    """Page through all profiles in id order using keyset pagination"""
+    fields = _requested_fields('id')
+    if fields is None:
+        return _json({'error': 'unknown field'}, 400)
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+    stmt = (_select(fields)
+            .where(MedicalProfile.id > after)
+            .order_by(MedicalProfile.id)
+            .limit(limit))
+    profiles = [MedicalProfile.serialize(row, fields) for row in db.session.execute(stmt)]
+
+    return _json({
+        'profiles': profiles,
+        'next_after': profiles[-1]['id'] if len(profiles) == limit else None,
+    })
+
+
+def _checkup_history_query(username):
+    """Return (profile id, newest-first select over its checkups), or (None, None) if unknown"""
+    profile_id = db.session.execute(
+        select(MedicalProfile.id).where(MedicalProfile.username == username)).scalar()
+    if profile_id is None:
+        return None, None
+    columns = (getattr(CheckupRecord, field) for field in CheckupRecord.SERIALIZED_FIELDS)
+    # Served by the (profile_id, checkup_date) index
+    stmt = (select(*columns)
+            .where(CheckupRecord.profile_id == profile_id)
+            .order_by(CheckupRecord.checkup_date.desc(), CheckupRecord.id.desc()))
+    return profile_id, stmt
+
+
+@api.route('/profiles/<username>/checkups/latest')
+@require_api_token
+@read_replica
+def latest_checkup(username):
+    """Return the newest checkup entry of a profile"""
+    profile_id, stmt = _checkup_history_query(username)
+    if profile_id is None:
+        return _json({'error': 'not found'}, 404)
+    row = db.session.execute(stmt.limit(1)).first()
+    return _json({'checkup': MedicalProfile.serialize(row, CheckupRecord.SERIALIZED_FIELDS) if row else None})
+
+
+@api.route('/profiles/<username>/checkups')
+@require_api_token
+@read_replica
+def checkup_history(username):
+    """Page through a profile's checkups, newest first
+
+    Pass the returned next_before ("<checkup_date>,<id>") as ?before= for
+    the following page.
+    """
+    before = request.args.get('before')
+    if before:
+        try:
+            before_date, before_id = before.split(',')
+            before = (date.fromisoformat(before_date), int(before_id))
+        except ValueError:
+            return _json({'error': 'before must be "<checkup_date>,<id>"'}, 400)
+    limit = min(max(request.args.get('limit', DEFAULT_HISTORY_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+    profile_id, stmt = _checkup_history_query(username)
+    if profile_id is None:
+        return _json({'error': 'not found'}, 404)
+    if before:
+        stmt = stmt.where(tuple_(CheckupRecord.checkup_date, CheckupRecord.id) < before)
+    checkups = [MedicalProfile.serialize(row, CheckupRecord.SERIALIZED_FIELDS)
+                for row in db.session.execute(stmt.limit(limit))]
+
+    last = checkups[-1] if len(checkups) == limit else None
+    return _json({
+        'checkups': checkups,
+        'next_before': f"{last['checkup_date']},{last['id']}" if last else None,
+    })
@@ -1,10 +1,32 @@
-from flask import Flask, request, render_template, redirect, url_for, send_file
+from flask import Flask, request, render_template, redirect, url_for, send_file, abort, stream_with_context
 import os
-import qrcode
+import click
+import tempfile
 import logging
-from datetime import datetime
-from models import db, MedicalProfile
+from datetime import datetime, timezone
+from models import (db, MedicalProfile, parse_checkup_date, profile_fields_from_form, record_checkup,
+                    save_with_unique_username, seed_checkup_history)
+from qr_cache import QRCache, QR_FORMATS, DEFAULT_BOX_SIZE, MAX_BOX_SIZE, ERROR_CORRECT_M
+from qr_payload import (InvalidPayload, PayloadTooLarge, decode_payload, encode_payload, fit_payload, signing_key,
+                        verify_key)
+from qr_batch import BATCH_FORMATS, iter_usernames, stream_batch
+from cards import (CARD_FORMATS, CARD_LAYOUTS, PAGE_SIZES, SHEET_FORMATS, CardCache, CardStyle, card_pdf,
+                   card_png, card_version, find_card_fonts, get_card, iter_cards, sheet_slots, stream_sheets)
+from profile_cache import PROFILE_PREFETCH_ENVIRON, create_profile_cache
+from page_cache import PageCache
+from api import api, require_api_token
+from profile_import import IMPORT_FORMATS, guess_format, import_profiles
+from profile_export import EXPORT_FORMATS, parse_updated_since, stream_export
+from metrics import Metrics
+from rendering import init_app as init_rendering
+from jobs import create_job_queue
+from rate_limit import create_rate_limiter, rate_limit
+from profile_search import install_search_index
+from database import (REPLICA_BIND, engine_options, pool_size_for_workers, primary_reads, read_replica,
+                      init_app as init_database)
+from sqlalchemy import func, select
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.http import is_resource_modified
 from io import BytesIO
 
 # Configure logging for debugging
@@ -12,7 +34,8 @@ logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
+# needed for url_for to generate with https, and for the client IP the rate limiter keys on
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
 # Database configuration
 database_url = os.environ.get("DATABASE_URL")
@@ -21,68 +44,175 @@ if not database_url:
     database_url = "sqlite:///medical_profiles.db"
 
 app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+
+# Connection pool, per worker process. DB_MAX_CONNECTIONS splits a server-wide
+# connection budget across WEB_CONCURRENCY workers when DB_POOL_SIZE is unset.
+# DB_POOL_PRE_PING: always (ping every checkout), idle (only connections unused
+# for DB_POOL_PING_IDLE_SECONDS) or never (rely on pool_recycle).
+app.config["DB_POOL_SIZE"] = int(os.environ["DB_POOL_SIZE"]) if os.environ.get("DB_POOL_SIZE") else None
+if app.config["DB_POOL_SIZE"] is None and os.environ.get("DB_MAX_CONNECTIONS"):
+    app.config["DB_POOL_SIZE"] = pool_size_for_workers(int(os.environ["DB_MAX_CONNECTIONS"]),
+                                                       int(os.environ.get("WEB_CONCURRENCY", 1)))
+app.config["DB_MAX_OVERFLOW"] = int(os.environ["DB_MAX_OVERFLOW"]) if os.environ.get("DB_MAX_OVERFLOW") else None
+app.config["DB_POOL_TIMEOUT"] = float(os.environ["DB_POOL_TIMEOUT"]) if os.environ.get("DB_POOL_TIMEOUT") else None
+app.config["DB_POOL_RECYCLE"] = int(os.environ.get("DB_POOL_RECYCLE", 300))
+app.config["DB_POOL_PRE_PING"] = os.environ.get("DB_POOL_PRE_PING", "idle")
+app.config["DB_POOL_PING_IDLE_SECONDS"] = float(os.environ.get("DB_POOL_PING_IDLE_SECONDS", 30))
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+    app.config["DB_POOL_SIZE"], app.config["DB_MAX_OVERFLOW"], app.config["DB_POOL_TIMEOUT"],
+    app.config["DB_POOL_RECYCLE"], app.config["DB_POOL_PRE_PING"])
+
+# Optional read replica for read-only views; clients that just wrote stay on
+# the primary for REPLICA_STICKY_SECONDS so they see their own changes
+app.config["DATABASE_REPLICA_URL"] = os.environ.get("DATABASE_REPLICA_URL")
+app.config["REPLICA_STICKY_SECONDS"] = int(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+if app.config["DATABASE_REPLICA_URL"]:
+    app.config["SQLALCHEMY_BINDS"] = {
+        REPLICA_BIND: {"url": app.config["DATABASE_REPLICA_URL"], **app.config["SQLALCHEMY_ENGINE_OPTIONS"]},
+    }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Public origin (e.g. https://medical.example.org) that QR codes and printed
+# cards link to; Render sets RENDER_EXTERNAL_URL. Without it links follow the
+# request's Host header, which clients control.
+app.config["PUBLIC_BASE_URL"] = os.environ.get("PUBLIC_BASE_URL") or os.environ.get("RENDER_EXTERNAL_URL")
+if not app.config["PUBLIC_BASE_URL"]:
+    app.logger.warning("PUBLIC_BASE_URL is not set, QR codes and cards will link to the request's Host")
+
+# QR code cache configuration
+app.config["QR_CACHE_SIZE"] = int(os.environ.get("QR_CACHE_SIZE", 1024))
+app.config["QR_CACHE_MAX_AGE"] = int(os.environ.get("QR_CACHE_MAX_AGE", 86400))
+# Profile link codes pre-rendered at signup are also kept in QR_CACHE_DIR, shared
+# by every worker on the host (default: under the temp dir; empty disables it),
+# up to QR_CACHE_DIR_MAX_FILES images
+app.config["QR_CACHE_DIR"] = os.environ.get("QR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "qr-cache"))
+app.config["QR_CACHE_DIR_MAX_FILES"] = int(os.environ.get("QR_CACHE_DIR_MAX_FILES", 50000))
+qr_cache = QRCache(max_entries=app.config["QR_CACHE_SIZE"], directory=app.config["QR_CACHE_DIR"] or None,
+                   max_files=app.config["QR_CACHE_DIR_MAX_FILES"])
+
+# Secret the Ed25519 key for offline (embedded) QR payloads is derived from;
+# readers only get the public key from /qr/verify-key. Unset disables
+# embedded mode.
+app.config["QR_SIGNING_KEY"] = os.environ.get("QR_SIGNING_KEY")
+if app.config["QR_SIGNING_KEY"] and app.config["QR_SIGNING_KEY"] == app.secret_key:
+    raise RuntimeError("QR_SIGNING_KEY must differ from SESSION_SECRET")
+qr_signing_key = signing_key(app.config["QR_SIGNING_KEY"]) if app.config["QR_SIGNING_KEY"] else None
+
+# Profile cache configuration (in-process for a single worker, redis:// URL to share between workers)
+app.config["PROFILE_CACHE_URL"] = os.environ.get("PROFILE_CACHE_URL")
+app.config["PROFILE_CACHE_TTL"] = int(os.environ["PROFILE_CACHE_TTL"]) if os.environ.get("PROFILE_CACHE_TTL") else None
+app.config["PROFILE_CACHE_SIZE"] = int(os.environ.get("PROFILE_CACHE_SIZE", 4096))
+profile_cache = create_profile_cache(app.config["PROFILE_CACHE_URL"], app.config["PROFILE_CACHE_TTL"],
+                                     app.config["PROFILE_CACHE_SIZE"], int(os.environ.get("WEB_CONCURRENCY", 1)))
+app.extensions["profile_cache"] = profile_cache
+
+# Rendered profile page cache; bump PAGE_CACHE_VERSION to invalidate after template changes
+app.config["PAGE_CACHE_SIZE"] = int(os.environ.get("PAGE_CACHE_SIZE", 2048))
+app.config["PAGE_CACHE_VERSION"] = os.environ.get("PAGE_CACHE_VERSION", os.environ.get("RENDER_GIT_COMMIT", "dev"))
+page_cache = PageCache(max_entries=app.config["PAGE_CACHE_SIZE"])
+
+# Bulk QR generation limits
+app.config["QR_BATCH_MAX_PROFILES"] = int(os.environ.get("QR_BATCH_MAX_PROFILES", 20000))
+app.config["QR_BATCH_WORKERS"] = int(os.environ.get("QR_BATCH_WORKERS", os.cpu_count() or 1))
+
+# Printable cards; CARD_FONT/CARD_BOLD_FONT are TrueType files (an installed
+# system font is looked up once here when unset) and CARD_LOGO an image drawn
+# in the card's title band
+app.config["CARD_CACHE_SIZE"] = int(os.environ.get("CARD_CACHE_SIZE", 2048))
+app.config["CARD_FONT"], app.config["CARD_BOLD_FONT"] = find_card_fonts(os.environ.get("CARD_FONT"),
+                                                                        os.environ.get("CARD_BOLD_FONT"))
+app.config["CARD_LOGO"] = os.environ.get("CARD_LOGO")
+card_cache = CardCache(max_entries=app.config["CARD_CACHE_SIZE"])
+card_style = CardStyle(app.config["CARD_FONT"], app.config["CARD_BOLD_FONT"], app.config["CARD_LOGO"])
+
+# Bulk import batch size (rows per INSERT)
+app.config["IMPORT_CHUNK_SIZE"] = int(os.environ.get("IMPORT_CHUNK_SIZE", 1000))
+
+# Bulk export page size (rows per keyset query)
+app.config["EXPORT_PAGE_SIZE"] = int(os.environ.get("EXPORT_PAGE_SIZE", 5000))
+
+# Instrumentation; set PROFILE_SLOW_REQUESTS_MS to dump folded stacks for slow requests
+app.config["PROFILE_SLOW_REQUESTS_MS"] = int(os.environ.get("PROFILE_SLOW_REQUESTS_MS", 0))
+app.config["PROFILE_OUTPUT_DIR"] = os.environ.get("PROFILE_OUTPUT_DIR", "profiles")
+metrics = Metrics()
+metrics.init_app(app)
+metrics.add_cache('qr_cache', qr_cache)
+metrics.add_cache('profile_cache', profile_cache)
+metrics.add_cache('page_cache', page_cache)
+metrics.add_cache('card_cache', card_cache)
+
+# Templates are minified and compiled once per process at startup; compiled
+# bytecode is kept in TEMPLATE_CACHE_DIR (default: under the temp dir)
+app.config["TEMPLATE_MINIFY"] = os.environ.get("TEMPLATE_MINIFY", "1") != "0"
+app.config["TEMPLATE_CACHE_DIR"] = os.environ.get("TEMPLATE_CACHE_DIR")
+init_rendering(app)
+
+# Background jobs; JOB_QUEUE_URL=sqlite:///jobs.db keeps queued work across restarts
+app.config["JOB_QUEUE_URL"] = os.environ.get("JOB_QUEUE_URL")
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", 2))
+app.config["JOB_MAX_PENDING"] = int(os.environ.get("JOB_MAX_PENDING", 1000))
+app.config["JOB_MAX_ATTEMPTS"] = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+jobs = create_job_queue(app.config["JOB_QUEUE_URL"], workers=app.config["JOB_WORKERS"],
+                        max_pending=app.config["JOB_MAX_PENDING"], max_attempts=app.config["JOB_MAX_ATTEMPTS"])
+jobs.init_app(app)
+metrics.add_job_queue(jobs)
+
+# Per-client rate limits by route group (see rate_limit.DEFAULT_LIMITS), e.g.
+# RATE_LIMITS="scan=300/minute,create=5/minute". RATE_LIMIT_URL=sqlite:///ratelimit.db
+# shares the buckets between workers; RATE_LIMIT_EXEMPT lists trusted networks
+# (CIDRs, comma separated) such as a hospital's, which are never limited.
+app.config["RATE_LIMIT_ENABLED"] = os.environ.get("RATE_LIMIT_ENABLED", "1") != "0"
+app.config["RATE_LIMIT_URL"] = os.environ.get("RATE_LIMIT_URL")
+app.config["RATE_LIMITS"] = os.environ.get("RATE_LIMITS")
+app.config["RATE_LIMIT_EXEMPT"] = os.environ.get("RATE_LIMIT_EXEMPT", "")
+if app.config["RATE_LIMIT_ENABLED"]:
+    rate_limiter = create_rate_limiter(app.config["RATE_LIMIT_URL"], app.config["RATE_LIMITS"],
+                                       app.config["RATE_LIMIT_EXEMPT"].split(','))
+    rate_limiter.init_app(app)
+    metrics.add_rate_limiter(rate_limiter)
+
+@jobs.task('prerender_qr')
+def prerender_qr(data):
+    """Render a profile link QR code into the shared cache before its first scan"""
+    qr_cache.prerender(data, 'png', DEFAULT_BOX_SIZE, ERROR_CORRECT_M)
+
 # Initialize database
 db.init_app(app)
+metrics.add_pools(init_database(app, db))
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+# JSON API, metrics and bulk routes; requests must carry "Authorization: Bearer
+# <API_TOKEN>", and without a token those routes answer 503
+app.config["API_TOKEN"] = os.environ.get("API_TOKEN")
+if not app.config["API_TOKEN"]:
+    app.logger.warning("API_TOKEN is not set, the JSON API, metrics, import/export and bulk routes are disabled")
+app.register_blueprint(api)
+
+# Tables are created by `flask --app app init-db` (run from build.sh), not at
+# import, so booting a worker never touches the database
 
 @app.route('/', methods=['GET', 'POST'])
+@rate_limit('create', methods=('POST',))
 def index():
     """Main route for user registration form and profile creation"""
     if request.method == 'POST':
-        # Debug: Log form data
-        app.logger.info(f"Form data received: {dict(request.form)}")
-        username = request.form.get('username', '').strip().lower()
-        
-        # Generate username if not provided
-        if not username:
-            import time
-            username = f"profile_{int(time.time())}"
-        
-        # Check if username already exists
-        existing_profile = MedicalProfile.query.filter_by(username=username).first()
-        if existing_profile:
-            import time
-            username = f"{username}_{int(time.time())}"
-        
-        # Get form data
-        name = request.form.get('name', '').strip()
-        if not name:
-            name = "Anonymous User"
-            
-        # Parse checkup date
-        checkup_date_str = request.form.get('last_checkup_date', '')
-        checkup_date = None
-        if checkup_date_str:
-            try:
-                checkup_date = datetime.strptime(checkup_date_str, '%Y-%m-%d').date()
-            except ValueError:
-                checkup_date = None
+        # Field names only; the values are medical data
+        app.logger.debug(f"Signup form fields: {', '.join(sorted(request.form))}")
+        fields = profile_fields_from_form(request.form)
+        username = fields['username']
 
         try:
             # Create new profile
-            profile = MedicalProfile(
-                username=username,
-                name=name,
-                blood_type=request.form.get('blood_type', ''),
-                allergy=request.form.get('allergy', '').strip(),
-                condition=request.form.get('condition', '').strip(),
-                emergency_contact=request.form.get('emergency_contact', '').strip(),
-                last_checkup_date=checkup_date,
-                last_checkup_details=request.form.get('last_checkup_details', '').strip()
-            )
+            profile = MedicalProfile(**fields)
             
-            # Save to database
-            db.session.add(profile)
-            db.session.commit()
+            # Save to database, suffixing the username if it is already taken; the
+            # signup checkup becomes the first history entry in the same transaction
+            username = save_with_unique_username(profile)
+            profile_cache.delete(username)
+            try:
+                # Same data and options as the default /qr/<username> request
+                jobs.enqueue('prerender_qr', profile_link(username))
+            except Exception as e:
+                app.logger.warning(f"Could not queue QR pre-render for {username}: {e}")
 
             app.logger.info(f"Profile created successfully for user: {username}")
             return redirect(url_for('view_profile', username=username))
@@ -92,168 +222,310 @@ def index():
             app.logger.error(f"Error creating profile for {username}: {str(e)}")
             return render_template('form.html', error="An error occurred while creating your profile. Please try again.")
 
-    try:
-        return render_template('form.html')
-    except:
-        # Fallback HTML form if template is missing
-        return '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Medical Emergency Profile</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-        </head>
-        <body data-bs-theme="dark">
-            <div class="container mt-5">
-                <div class="row justify-content-center">
-                    <div class="col-lg-8">
-                        <div class="card">
-                            <div class="card-header bg-danger text-white text-center py-4">
-                                <h2>Create Medical Emergency Profile</h2>
-                                <p class="mb-0">This information will be accessible via QR code for emergency situations</p>
-                            </div>
-                            <div class="card-body p-4">
-                                <form method="POST" action="/">
-                                    <div class="row mb-3">
-                                        <div class="col-md-6">
-                                            <label for="name" class="form-label">Full Name *</label>
-                                            <input type="text" class="form-control" id="name" name="name" required>
-                                        </div>
-                                        <div class="col-md-6">
-                                            <label for="username" class="form-label">Username (optional)</label>
-                                            <input type="text" class="form-control" id="username" name="username">
-                                        </div>
-                                    </div>
-                                    <div class="row mb-3">
-                                        <div class="col-md-6">
-                                            <label for="blood_type" class="form-label">Blood Type</label>
-                                            <select class="form-select" id="blood_type" name="blood_type">
-                                                <option value="">Select Blood Type</option>
-                                                <option value="A+">A+</option>
-                                                <option value="A-">A-</option>
-                                                <option value="B+">B+</option>
-                                                <option value="B-">B-</option>
-                                                <option value="AB+">AB+</option>
-                                                <option value="AB-">AB-</option>
-                                                <option value="O+">O+</option>
-                                                <option value="O-">O-</option>
-                                            </select>
-                                        </div>
-                                        <div class="col-md-6">
-                                            <label for="emergency_contact" class="form-label">Emergency Contact *</label>
-                                            <input type="text" class="form-control" id="emergency_contact" name="emergency_contact" required>
-                                        </div>
-                                    </div>
-                                    <div class="row mb-3">
-                                        <div class="col-md-6">
-                                            <label for="allergy" class="form-label">Allergies</label>
-                                            <textarea class="form-control" id="allergy" name="allergy" rows="3"></textarea>
-                                        </div>
-                                        <div class="col-md-6">
-                                            <label for="condition" class="form-label">Medical Conditions</label>
-                                            <textarea class="form-control" id="condition" name="condition" rows="3"></textarea>
-                                        </div>
-                                    </div>
-                                    <div class="text-center">
-                                        <button type="submit" class="btn btn-success btn-lg">Create Profile & Generate QR Code</button>
-                                    </div>
-                                </form>
-                            </div>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
+    return render_template('form.html')
+
+def profile_link(username):
+    """The absolute profile URL that QR codes and cards point at"""
+    if app.config["PUBLIC_BASE_URL"]:
+        return app.config["PUBLIC_BASE_URL"].rstrip('/') + url_for('view_profile', username=username)
+    return url_for('view_profile', username=username, _external=True)
+
+def get_profile_info(username):
+    """Return the profile dict for username through the profile cache, or None"""
+    prefetched = request.environ.get(PROFILE_PREFETCH_ENVIRON)
+    if prefetched is not None and prefetched[0] == username:
+        # Already loaded from the primary by the ASGI entry point
+        info = prefetched[1]
+        if info is not None:
+            profile_cache.set(username, info)
+        return info
+    info = profile_cache.get(username)
+    if info is None:
+        # What is cached is served to everyone, so it is never read from a lagging replica
+        with primary_reads(profile_cache.stores), metrics.timed('profile_query'):
+            profile = MedicalProfile.query.filter_by(username=username).first()
+        if not profile:
+            return None
+        info = profile.to_dict()
+        profile_cache.set(username, info)
+    return info
 
 @app.route('/profile/<username>')
+@rate_limit('scan', misses='miss')
+@read_replica
 def view_profile(username):
     """Display user profile with medical information"""
     try:
-        profile = MedicalProfile.query.filter_by(username=username).first()
-        
-        if not profile:
+        info = get_profile_info(username)
+        if info is None:
             app.logger.warning(f"Profile not found for username: {username}")
             return render_template('not_found.html', username=username), 404
         
-        # Convert profile to dict for template
-        info = {
-            'name': profile.name,
-            'blood_type': profile.blood_type,
-            'allergy': profile.allergy,
-            'condition': profile.condition,
-            'emergency_contact': profile.emergency_contact,
-            'last_checkup_date': profile.last_checkup_date.isoformat() if profile.last_checkup_date else None,
-            'last_checkup_details': profile.last_checkup_details,
-            'doctor_notes': profile.doctor_notes
-        }
-        
-        # Generate QR code
-        profile_link = url_for('view_profile', username=username, _external=True)
-        qr_dir = os.path.join(app.static_folder, 'qr')
-        os.makedirs(qr_dir, exist_ok=True)
-        qr_path = os.path.join(qr_dir, f"{username}.png")
-        
-        if not os.path.exists(qr_path):
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_M,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(profile_link)
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white")
-            img.save(qr_path)
-            app.logger.info(f"Generated QR code for {username} at {qr_path}")
-
-        qr_code_url = url_for('static', filename=f'qr/{username}.png')
-        
         app.logger.info(f"Profile accessed for user: {username}")
-        try:
-            return render_template('profile.html', info=info, qr_code_url=qr_code_url, username=username)
-        except:
-            # Fallback HTML profile display if template is missing
-            return f'''
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>{info["name"]} - Medical Profile</title>
-                <meta name="viewport" content="width=device-width, initial-scale=1">
-                <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-            </head>
-            <body data-bs-theme="dark">
-                <div class="container mt-5">
-                    <div class="card">
-                        <div class="card-header bg-danger text-white text-center">
-                            <h1>{info["name"]}</h1>
-                            <p>Emergency Medical Information</p>
-                        </div>
-                        <div class="card-body">
-                            {f'<div class="alert alert-danger"><strong>Blood Type:</strong> {info["blood_type"]}</div>' if info["blood_type"] else ''}
-                            {f'<div class="alert alert-success"><strong>Emergency Contact:</strong> {info["emergency_contact"]}</div>' if info["emergency_contact"] else ''}
-                            {f'<div class="alert alert-warning"><strong>Allergies:</strong> {info["allergy"]}</div>' if info["allergy"] else ''}
-                            {f'<div class="alert alert-info"><strong>Medical Conditions:</strong> {info["condition"]}</div>' if info["condition"] else ''}
-                            {f'<div class="alert alert-secondary"><strong>Last Checkup:</strong> {info["last_checkup_date"]}<br>{info["last_checkup_details"]}</div>' if info["last_checkup_date"] or info["last_checkup_details"] else ''}
-                            {f'<div class="alert alert-primary"><strong>Doctor Notes:</strong> {info["doctor_notes"]}</div>' if info["doctor_notes"] else ''}
-                        </div>
-                    </div>
-                    <div class="text-center mt-3">
-                        <a href="/" class="btn btn-primary">Create New Profile</a>
-                        <a href="/edit/{username}" class="btn btn-secondary">Update Checkup</a>
-                    </div>
-                </div>
-            </body>
-            </html>
-            '''
+
+        # Answer revalidation from the profile version alone, without rendering
+        version = info.get('updated_at') or ''
+        last_modified = datetime.fromisoformat(version).replace(tzinfo=timezone.utc) if version else None
+        etag = page_cache.make_etag(username, version, app.config["PAGE_CACHE_VERSION"])
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = app.response_class(status=304)
+        else:
+            def render_page():
+                # QR code is rendered and cached in memory by the qr_code endpoint
+                qr_code_url = url_for('qr_code', username=username)
+                return render_template('profile.html', info=info, qr_code_url=qr_code_url, username=username)
+
+            with metrics.timed('profile_render'):
+                page = page_cache.get_or_render((username, version), etag, render_page)
+            body, encoding = page.negotiate(request.accept_encodings)
+            response = app.response_class(body, mimetype='text/html')
+            if encoding != 'identity':
+                response.content_encoding = encoding
+
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.vary.add('Accept-Encoding')
+        # Always revalidate so an updated profile is never served from a stale copy
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
         
     except Exception as e:
         app.logger.error(f"Error loading profile for {username}: {str(e)}")
         return render_template('not_found.html', username=username, error="Profile data corrupted"), 500
 
+@app.route('/qr/<username>')
+@rate_limit('scan', misses='miss')
+def qr_code(username):
+    """Serve the QR code linking to a profile from the in-memory cache"""
+    fmt = request.args.get('format', 'png').lower()
+    if fmt not in QR_FORMATS:
+        abort(404)
+    box_size = request.args.get('scale', DEFAULT_BOX_SIZE, type=int)
+    if not 1 <= box_size <= MAX_BOX_SIZE:
+        box_size = DEFAULT_BOX_SIZE
+    if len(username) > MedicalProfile.username.type.length:
+        abort(404)
+
+    mode = request.args.get('mode')
+    if mode == 'embedded':
+        # Offline mode: the code carries the signed critical data itself
+        if qr_signing_key is None:
+            app.logger.warning("Embedded QR requested but QR_SIGNING_KEY is not set")
+            abort(503)
+        info = get_profile_info(username)
+        if info is None:
+            abort(404)
+        data = encode_payload(info, qr_signing_key)
+        try:
+            error_correction, _ = fit_payload(data)
+        except PayloadTooLarge:
+            app.logger.warning(f"Embedded QR payload for {username} does not fit in a QR code")
+            abort(422)
+    else:
+        data = profile_link(username)
+        error_correction = ERROR_CORRECT_M
+
+    with metrics.timed('qr_render'):
+        # Link codes may come from the pre-rendered files, which requests never write;
+        # embedded ones carry medical data and stay in memory
+        body, etag = qr_cache.get(data, fmt, box_size, error_correction, shared=mode != 'embedded')
+
+    response = app.response_class(body, mimetype=QR_FORMATS[fmt])
+    response.set_etag(etag)
+    if mode == 'embedded':
+        # Medical data is in the image, keep it out of shared caches
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config["QR_CACHE_MAX_AGE"]
+    return response.make_conditional(request)
+
+@app.route('/qr/decode', methods=['POST'])
+@rate_limit('api')
+def qr_decode():
+    """Verify and unpack an embedded QR payload"""
+    data = request.get_json(silent=True)
+    payload = data.get('payload') if isinstance(data, dict) else request.form.get('payload', '')
+    if not isinstance(payload, str) or not payload.strip():
+        return {'error': 'payload must be a non-empty string'}, 400
+    if qr_signing_key is None:
+        abort(503)
+    try:
+        return decode_payload(payload.strip(), verify_key(qr_signing_key))
+    except InvalidPayload as e:
+        return {'error': str(e)}, 400
+
+@app.route('/qr/verify-key')
+@rate_limit('api')
+def qr_verify_key():
+    """Publish the public key offline readers verify embedded payloads with"""
+    if qr_signing_key is None:
+        abort(503)
+    return {'algorithm': 'Ed25519', 'key': verify_key(qr_signing_key).hex()}
+
+@app.route('/qr/batch', methods=['POST'])
+@rate_limit('bulk')
+@require_api_token
+def qr_batch():
+    """Stream a ZIP of PNGs or a multi-page PDF of QR codes for many profiles"""
+    fmt = request.values.get('format', 'zip').lower()
+    if fmt not in BATCH_FORMATS:
+        abort(400)
+    box_size = request.values.get('scale', DEFAULT_BOX_SIZE, type=int)
+    if not 1 <= box_size <= MAX_BOX_SIZE:
+        box_size = DEFAULT_BOX_SIZE
+
+    # Accept repeated username fields or one newline/comma separated list
+    usernames = []
+    for value in request.values.getlist('username'):
+        usernames.extend(u.strip().lower() for u in value.replace(',', '\n').splitlines() if u.strip())
+    if not usernames or len(usernames) > app.config["QR_BATCH_MAX_PROFILES"]:
+        abort(400)
+
+    stats = {'count': 0, 'elapsed': 0.0}
+
+    def record_progress(count, elapsed):
+        stats.update(count=count, elapsed=elapsed)
+
+    @stream_with_context
+    def generate():
+        yield from stream_batch(iter_usernames(usernames), profile_link, fmt, box_size,
+                                workers=app.config["QR_BATCH_WORKERS"], progress=record_progress)
+        app.logger.info(f"Batch QR export rendered {stats['count']} codes in {stats['elapsed']:.2f}s")
+
+    response = app.response_class(generate(), mimetype=BATCH_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=qr_codes.{fmt}'
+    return response
+
+@app.route('/card/<username>')
+@rate_limit('print', misses='miss')
+@read_replica
+def printable_card(username):
+    """Serve a printable emergency card (PNG or single-page PDF) for one profile"""
+    layout = CARD_LAYOUTS.get(request.args.get('layout', 'wallet'))
+    fmt = request.args.get('format', 'png').lower()
+    if layout is None or fmt not in CARD_FORMATS:
+        abort(404)
+    card = next(iter_cards([username]), None)
+    if card is None:
+        abort(404)
+
+    # Answer revalidation from the profile version and link alone, without rendering
+    link = profile_link(username)
+    etag = page_cache.make_etag(username, layout.name, fmt, *card_version(card, link))
+    if not is_resource_modified(request.environ, etag=etag):
+        response = app.response_class(status=304)
+    else:
+        with metrics.timed('card_render'):
+            bitmap = get_card(card, link, layout, card_cache, card_style)
+            body = card_png(bitmap) if fmt == 'png' else card_pdf(bitmap, layout)
+        response = app.response_class(body, mimetype=CARD_FORMATS[fmt])
+        response.headers['Content-Disposition'] = f'inline; filename={username}-{layout.name}.{fmt}'
+    response.set_etag(etag)
+    # Medical data is on the card, keep it out of shared caches
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/cards/sheet', methods=['POST'])
+@rate_limit('bulk')
+@require_api_token
+def card_sheet():
+    """Stream N-up sheets of printable cards for the given (or all) profiles"""
+    layout = CARD_LAYOUTS.get(request.values.get('layout', 'wallet'))
+    fmt = request.values.get('format', 'pdf').lower()
+    page = request.values.get('page', 'a4').lower()
+    per_page = request.values.get('per_page', type=int)
+    if layout is None or fmt not in SHEET_FORMATS or page not in PAGE_SIZES:
+        return {'error': f"layout must be one of {', '.join(CARD_LAYOUTS)}, format one of "
+                         f"{', '.join(SHEET_FORMATS)} and page one of {', '.join(PAGE_SIZES)}"}, 400
+    try:
+        sheet_slots(layout, page, per_page)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    # Same username list forms as /qr/batch; none means every profile, under the same cap
+    usernames = []
+    for value in request.values.getlist('username'):
+        usernames.extend(u.strip().lower() for u in value.replace(',', '\n').splitlines() if u.strip())
+    if len(usernames) > app.config["QR_BATCH_MAX_PROFILES"]:
+        abort(400)
+    if not usernames:
+        total = db.session.execute(select(func.count()).select_from(MedicalProfile)).scalar()
+        if total > app.config["QR_BATCH_MAX_PROFILES"]:
+            return {'error': f"{total} profiles exceed QR_BATCH_MAX_PROFILES "
+                             f"({app.config['QR_BATCH_MAX_PROFILES']}); pass usernames or use print-cards"}, 400
+
+    stats = {'count': 0, 'elapsed': 0.0}
+
+    def record_progress(count, elapsed):
+        stats.update(count=count, elapsed=elapsed)
+
+    @stream_with_context
+    def generate():
+        yield from stream_sheets(iter_cards(usernames or None), profile_link, layout, card_cache, fmt, page,
+                                 per_page, card_style, workers=app.config["QR_BATCH_WORKERS"],
+                                 progress=record_progress)
+        app.logger.info(f"Card sheets rendered {stats['count']} cards in {stats['elapsed']:.2f}s")
+
+    response = app.response_class(generate(), mimetype=SHEET_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=cards-{layout.name}.{fmt}'
+    return response
+
+@app.route('/import', methods=['POST'])
+@rate_limit('bulk')
+@require_api_token
+def import_upload():
+    """Bulk-create profiles from an uploaded CSV or NDJSON file"""
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return {'error': 'multipart uploads must include a file field'}, 400
+        stream, filename = upload.stream, upload.filename
+    else:
+        # Raw request body, e.g. curl --data-binary @patients.ndjson; read before
+        # anything touches request.form, which would consume a form-encoded body
+        stream, filename = request.stream, None
+    fmt = request.args.get('format') or guess_format(filename)
+    if fmt not in IMPORT_FORMATS:
+        return {'error': f"format must be one of {', '.join(IMPORT_FORMATS)}"}, 400
+    chunk_size = request.args.get('chunk_size', app.config["IMPORT_CHUNK_SIZE"], type=int)
+
+    result = import_profiles(stream, fmt, chunk_size=max(chunk_size, 1))
+    app.logger.info(f"Imported {result.created} profiles ({result.failed} failed) from upload")
+    return result.to_dict()
+
+@app.route('/export')
+@rate_limit('bulk')
+@require_api_token
+def export_download():
+    """Stream all profiles, or those updated since a timestamp, as CSV or NDJSON"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return {'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}, 400
+    updated_since = None
+    if request.args.get('updated_since'):
+        try:
+            updated_since = parse_updated_since(request.args['updated_since'])
+        except ValueError:
+            return {'error': 'updated_since must be an ISO 8601 timestamp'}, 400
+
+    chunks = stream_export(fmt, updated_since, app.config["EXPORT_PAGE_SIZE"])
+    response = app.response_class(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=profiles.{fmt}'
+    return response
+
+@app.route('/metrics')
+@require_api_token
+def metrics_endpoint():
+    """Expose request, database and cache metrics in Prometheus text format"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/edit/<username>', methods=['GET', 'POST'])
+@rate_limit('edit', misses='miss')
+@read_replica
 def edit_checkup(username):
     """Doctor edit form for updating checkup information"""
     try:
@@ -263,27 +535,16 @@ def edit_checkup(username):
             return render_template('not_found.html', username=username), 404
         
         if request.method == 'POST':
-            # Parse checkup date
-            checkup_date_str = request.form.get('last_checkup_date', '')
-            checkup_date = None
-            if checkup_date_str:
-                try:
-                    checkup_date = datetime.strptime(checkup_date_str, '%Y-%m-%d').date()
-                except ValueError:
-                    checkup_date = None
-            
-            # Update checkup fields
-            profile.last_checkup_date = checkup_date
-            profile.last_checkup_details = request.form.get('last_checkup_details', '').strip()
-            
-            # Update doctor notes if provided
-            doctor_notes = request.form.get('doctor_notes', '').strip()
-            if doctor_notes:
-                profile.doctor_notes = doctor_notes
+            # Append to the checkup history; the profile keeps the latest entry as a snapshot
+            record_checkup(profile,
+                           parse_checkup_date(request.form.get('last_checkup_date', '')),
+                           request.form.get('last_checkup_details', '').strip(),
+                           request.form.get('doctor_notes', '').strip())
             
             try:
                 # Save updated data
                 db.session.commit()
+                profile_cache.delete(username)
                 
                 app.logger.info(f"Checkup updated for user: {username}")
                 return redirect(url_for('view_profile', username=username))
@@ -291,176 +552,179 @@ def edit_checkup(username):
             except Exception as e:
                 db.session.rollback()
                 app.logger.error(f"Error updating checkup for {username}: {str(e)}")
-                try:
-                    return render_template('edit_checkup.html', username=username,
-                                         info=profile, error="Failed to update checkup information")
-                except:
-                    # Fallback response for update error
-                    return f'''
-                    <!DOCTYPE html>
-                    <html>
-                    <head>
-                        <title>Update Error</title>
-                        <meta name="viewport" content="width=device-width, initial-scale=1">
-                        <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-                    </head>
-                    <body data-bs-theme="dark">
-                        <div class="container mt-5">
-                            <div class="alert alert-danger">
-                                <h4>Update Failed</h4>
-                                <p>Failed to update checkup information. Please try again.</p>
-                                <a href="/profile/{username}" class="btn btn-primary">Back to Profile</a>
-                                <a href="/edit/{username}" class="btn btn-secondary">Try Again</a>
-                            </div>
-                        </div>
-                    </body>
-                    </html>
-                    '''
+                return render_template('edit_checkup.html', username=username,
+                                       info=profile, error="Failed to update checkup information")
         
         # GET request - show edit form
-        try:
-            return render_template('edit_checkup.html', username=username, info=profile)
-        except:
-            # Fallback HTML for edit checkup form if template is missing
-            return f'''
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Update Medical Checkup - {profile.name}</title>
-                <meta name="viewport" content="width=device-width, initial-scale=1">
-                <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-            </head>
-            <body data-bs-theme="dark">
-                <div class="container mt-5">
-                    <div class="row justify-content-center">
-                        <div class="col-lg-8">
-                            <div class="card">
-                                <div class="card-header bg-info text-white text-center py-4">
-                                    <h2>Update Medical Checkup</h2>
-                                    <p class="mb-0">Patient: {profile.name}</p>
-                                </div>
-                                <div class="card-body p-4">
-                                    <form method="POST" action="/edit/{username}">
-                                        <div class="row mb-3">
-                                            <div class="col-md-6">
-                                                <label for="last_checkup_date" class="form-label">Last Checkup Date</label>
-                                                <input type="date" class="form-control" id="last_checkup_date" name="last_checkup_date"
-                                                       value="{profile.last_checkup_date or ''}">
-                                            </div>
-                                            <div class="col-md-6">
-                                                <label for="blood_type" class="form-label">Blood Type</label>
-                                                <select class="form-select" id="blood_type" name="blood_type">
-                                                    <option value="">Select Blood Type</option>
-                                                    {''.join([f'<option value="{bt}" {"selected" if profile.blood_type == bt else ""}>{bt}</option>' for bt in ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]])}
-                                                </select>
-                                            </div>
-                                        </div>
-                                        <div class="mb-3">
-                                            <label for="last_checkup_details" class="form-label">Checkup Details</label>
-                                            <textarea class="form-control" id="last_checkup_details" name="last_checkup_details" rows="4">{profile.last_checkup_details or ''}</textarea>
-                                        </div>
-                                        <div class="mb-3">
-                                            <label for="doctor_notes" class="form-label">Doctor Notes</label>
-                                            <textarea class="form-control" id="doctor_notes" name="doctor_notes" rows="4">{profile.doctor_notes or ''}</textarea>
-                                        </div>
-                                        <div class="mb-3">
-                                            <label for="allergy" class="form-label">Allergies</label>
-                                            <textarea class="form-control" id="allergy" name="allergy" rows="3">{profile.allergy or ''}</textarea>
-                                        </div>
-                                        <div class="mb-3">
-                                            <label for="condition" class="form-label">Medical Conditions</label>
-                                            <textarea class="form-control" id="condition" name="condition" rows="3">{profile.condition or ''}</textarea>
-                                        </div>
-                                        <div class="text-center">
-                                            <button type="submit" class="btn btn-success btn-lg">Update Medical Information</button>
-                                            <a href="/profile/{username}" class="btn btn-secondary btn-lg ms-2">Cancel</a>
-                                        </div>
-                                    </form>
-                                </div>
-                            </div>
-                        </div>
-                    </div>
-                </div>
-            </body>
-            </html>
-            '''
+        return render_template('edit_checkup.html', username=username, info=profile)
         
     except Exception as e:
         app.logger.error(f"Error loading profile for edit: {str(e)}")
-        # Fallback error page
-        return f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Profile Not Found</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-        </head>
-        <body data-bs-theme="dark">
-            <div class="container mt-5">
-                <div class="text-center">
-                    <h1 class="text-danger">Profile Not Found</h1>
-                    <p>The profile for username "{username}" could not be found.</p>
-                    <a href="/" class="btn btn-primary">Create New Profile</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        ''', 404
+        return render_template('not_found.html', username=username, error="Could not load the profile"), 500
 
 
 @app.errorhandler(404)
 def not_found_error(error):
     """Handle 404 errors"""
-    try:
-        return render_template('not_found.html'), 404
-    except:
-        return '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Page Not Found</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-        </head>
-        <body data-bs-theme="dark">
-            <div class="container mt-5">
-                <div class="text-center">
-                    <h1 class="text-danger">404 - Page Not Found</h1>
-                    <p>The requested page could not be found.</p>
-                    <a href="/" class="btn btn-primary">Create New Profile</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        ''', 404
+    return render_template('not_found.html'), 404
+
+@app.errorhandler(429)
+def rate_limited_error(error):
+    """Handle requests over a rate limit"""
+    response = app.make_response((render_template('not_found.html', error="Too many requests"), 429))
+    response.retry_after = error.retry_after
+    return response
 
 @app.errorhandler(500)
 def internal_error(error):
     """Handle 500 errors"""
     app.logger.error(f"Internal server error: {str(error)}")
+    return render_template('not_found.html', error="Internal server error"), 500
+
+def init_db():
+    """Create any missing database tables and search indexes"""
+    db.create_all()
+    # Start the checkup history of profiles that predate it
+    seeded = seed_checkup_history()
+    db.session.commit()
+    if seeded:
+        app.logger.info(f"Seeded checkup history for {seeded} profiles")
+    with db.engine.begin() as connection:
+        if not install_search_index(connection):
+            app.logger.warning(f"No full-text index for {connection.dialect.name}, search will scan the table")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create any missing database tables and search indexes"""
+    init_db()
+    click.echo("Database tables created successfully")
+
+@app.cli.command('generate-qr')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.argument('usernames', nargs=-1)
+@click.option('--format', 'fmt', type=click.Choice(sorted(BATCH_FORMATS)),
+              help='Archive format, defaults to the output file extension.')
+@click.option('--base-url', default=lambda: app.config["PUBLIC_BASE_URL"] or 'http://localhost:5000',
+              help='Public URL the QR codes should link to.')
+@click.option('--scale', default=DEFAULT_BOX_SIZE, type=click.IntRange(1, MAX_BOX_SIZE),
+              help='Pixels per QR module.')
+@click.option('--workers', default=None, type=click.IntRange(1),
+              help='Render processes, defaults to the number of CPUs.')
+@click.option('--chunk-size', default=1000, type=click.IntRange(1),
+              help='Profiles read from the database per batch.')
+def generate_qr_command(output, usernames, fmt, base_url, scale, workers, chunk_size):
+    """Render QR codes for all (or the given) profiles into a ZIP or PDF"""
+    if fmt is None:
+        fmt = 'pdf' if output.lower().endswith('.pdf') else 'zip'
+
+    def link_for(username):
+        return url_for('view_profile', username=username, _external=True)
+
+    def report(count, elapsed):
+        rate = count / elapsed if elapsed else 0
+        click.echo(f"\rRendered {count} codes in {elapsed:.1f}s ({rate:.0f}/s)", nl=False, err=True)
+
+    with app.test_request_context(base_url=base_url), open(output, 'wb') as fp:
+        for data in stream_batch(iter_usernames(usernames or None, chunk_size), link_for, fmt, scale,
+                                 workers=workers, progress=report):
+            fp.write(data)
+    click.echo(err=True)
+    click.echo(f"Wrote {output}")
+
+@app.cli.command('print-cards')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.argument('usernames', nargs=-1)
+@click.option('--layout', type=click.Choice(sorted(CARD_LAYOUTS)), default='wallet', help='Card layout.')
+@click.option('--format', 'fmt', type=click.Choice(sorted(SHEET_FORMATS)),
+              help='Sheet format, defaults to the output file extension.')
+@click.option('--page', type=click.Choice(sorted(PAGE_SIZES)), default='a4', help='Paper size.')
+@click.option('--per-page', type=click.IntRange(1), help='Cards per page, defaults to as many as fit.')
+@click.option('--base-url', default=lambda: app.config["PUBLIC_BASE_URL"] or 'http://localhost:5000',
+              help='Public URL the QR codes should link to.')
+@click.option('--workers', default=None, type=click.IntRange(1),
+              help='Render processes, defaults to the number of CPUs.')
+def print_cards_command(output, usernames, layout, fmt, page, per_page, base_url, workers):
+    """Render printable cards for all (or the given) profiles as N-up sheets"""
+    if fmt is None:
+        fmt = 'zip' if output.lower().endswith('.zip') else 'pdf'
+    layout = CARD_LAYOUTS[layout]
     try:
-        return render_template('not_found.html', error="Internal server error"), 500
-    except:
-        return '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Server Error</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-        </head>
-        <body data-bs-theme="dark">
-            <div class="container mt-5">
-                <div class="text-center">
-                    <h1 class="text-danger">500 - Internal Server Error</h1>
-                    <p>An internal server error occurred. Please try again later.</p>
-                    <a href="/" class="btn btn-primary">Create New Profile</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        ''', 500
+        sheet_slots(layout, page, per_page)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--per-page')
+
+    def link_for(username):
+        return url_for('view_profile', username=username, _external=True)
+
+    def report(count, elapsed):
+        rate = count / elapsed if elapsed else 0
+        click.echo(f"\rRendered {count} cards in {elapsed:.1f}s ({rate:.0f}/s)", nl=False, err=True)
+
+    with app.test_request_context(base_url=base_url), open(output, 'wb') as fp:
+        for data in stream_sheets(iter_cards(usernames or None), link_for, layout, card_cache, fmt, page,
+                                  per_page, card_style, workers=workers or os.cpu_count() or 1,
+                                  progress=report):
+            fp.write(data)
+    click.echo(err=True)
+    click.echo(f"Wrote {output}")
+
+@app.cli.command('import-profiles')
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS),
+              help='Input format, defaults to the file extension (CSV unless .ndjson/.jsonl).')
+@click.option('--chunk-size', default=lambda: app.config["IMPORT_CHUNK_SIZE"], type=click.IntRange(1),
+              help='Rows inserted per batch.')
+def import_profiles_command(source, fmt, chunk_size):
+    """Bulk-create profiles from a CSV or NDJSON file (- for stdin)"""
+    if fmt is None:
+        fmt = guess_format(source.name)
+
+    reported = renames = 0
+
+    def report(result):
+        nonlocal reported, renames
+        for error in result.errors[reported:]:
+            click.echo(f"row {error['row']}: {error['error']}", err=True)
+        for rename in result.renamed[renames:]:
+            click.echo(f"row {rename['row']}: username {rename['username']} is taken, "
+                       f"imported as {rename['imported_as']}", err=True)
+        reported, renames = len(result.errors), len(result.renamed)
+        click.echo(f"Imported {result.created} profiles, {result.failed} failed", err=True)
+
+    result = import_profiles(source, fmt, chunk_size=chunk_size, progress=report)
+    click.echo(f"Done: {result.created} created, {result.failed} failed")
+
+@app.cli.command('export-profiles')
+@click.argument('output', type=click.File('wb'))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)),
+              help='Output format, defaults to the file extension (NDJSON unless .csv).')
+@click.option('--updated-since', help='Only export profiles updated at or after this ISO 8601 timestamp.')
+@click.option('--page-size', default=lambda: app.config["EXPORT_PAGE_SIZE"], type=click.IntRange(1),
+              help='Rows fetched per keyset query.')
+def export_profiles_command(output, fmt, updated_since, page_size):
+    """Stream profiles to a CSV or NDJSON file (- for stdout)"""
+    if fmt is None:
+        fmt = 'csv' if output.name.lower().endswith('.csv') else 'ndjson'
+    if updated_since:
+        try:
+            updated_since = parse_updated_since(updated_since)
+        except ValueError:
+            raise click.BadParameter('expected an ISO 8601 timestamp', param_hint='--updated-since')
+
+    state = {'count': 0, 'newest': None}
+
+    def report(count, newest):
+        state.update(count=count, newest=newest)
+        click.echo(f"\rExported {count} profiles", nl=False, err=True)
+
+    for chunk in stream_export(fmt, updated_since or None, page_size, progress=report):
+        output.write(chunk)
+    click.echo(err=True)
+    if state['newest']:
+        click.echo(f"Newest updated_at: {state['newest'].isoformat()} (use as --updated-since next time)", err=True)
 
 if __name__ == '__main__':
+    # The development server sets up its own schema
+    with app.app_context():
+        init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
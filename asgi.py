@@ -0,0 +1,237 @@
+"""ASGI entry point for serving scan bursts from an event loop
+
+    WEB_CONCURRENCY=2 uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+
+WEB_CONCURRENCY must match --workers: the app picks its profile cache and
+pool sizes from it. Requests are handed to the Flask app on a bounded thread
+pool (ASGI_THREADS per worker) so a slow query or a cold QR render only
+occupies one thread, never the event loop. Profile page lookups not already
+in the in-process profile cache are first resolved with an async database
+query and handed to the Flask view in the WSGI environ, so it never holds a
+thread while waiting on the database. Clients that are out of scan (or
+unknown-profile) tokens get no prefetch, so rate-limited requests never
+reach the database.
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from sqlalchemy import select
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app import app as flask_app, profile_cache
+from models import db, MedicalProfile
+from profile_cache import PROFILE_PREFETCH_ENVIRON, RedisProfileCache
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PATH = re.compile(r'^/profile/([^/]+)$')
+# Rate limit groups of the view_profile route
+PROFILE_RATE_GROUPS = ('scan', 'miss')
+
+# Async drivers used for the profile prefetch, by sync driver name
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope into a WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def create_async_engine_for(url, pool_size):
+    """Create an async engine for the Flask app's database, or None if unsupported"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    drivername = ASYNC_DRIVERS.get(url.drivername)
+    if drivername is None:
+        logger.warning(f"No async driver for {url.drivername}, profile prefetch disabled")
+        return None
+    url = url.set(drivername=drivername)
+    if drivername == 'postgresql+asyncpg' and 'sslmode' in url.query:
+        # asyncpg spells libpq's sslmode as ssl
+        url = url.difference_update_query(['sslmode']).update_query_dict({'ssl': url.query['sslmode']})
+    options = {} if drivername.startswith('sqlite') else {'pool_size': pool_size, 'pool_pre_ping': True}
+    try:
+        return create_async_engine(url, **options)
+    except ImportError as e:
+        logger.warning(f"Async database driver unavailable ({e}), profile prefetch disabled")
+        return None
+
+
+def client_address_resolver(wsgi_app):
+    """Return a function giving the client address a request's environ resolves to behind wsgi_app's ProxyFix"""
+    if not isinstance(wsgi_app, ProxyFix):
+        return lambda environ: environ.get('REMOTE_ADDR')
+
+    def remote_addr(environ, start_response):
+        return environ.get('REMOTE_ADDR')
+
+    resolve = ProxyFix(remote_addr, x_for=wsgi_app.x_for, x_proto=wsgi_app.x_proto, x_host=wsgi_app.x_host,
+                       x_port=wsgi_app.x_port, x_prefix=wsgi_app.x_prefix)
+    return lambda environ: resolve(dict(environ), None)
+
+
+class ASGIApp:
+    """Run a WSGI app on a thread pool behind an async profile prefetch"""
+
+    def __init__(self, wsgi_app, threads=32, engine=None, limiter=None, client_address=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-wsgi')
+        self.engine = engine
+        self.limiter = limiter
+        self.client_address = client_address or (lambda environ: environ.get('REMOTE_ADDR'))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        await self._call_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _should_prefetch(self, scope, environ):
+        """Return the username of a profile page request worth prefetching, or None"""
+        if self.engine is None or scope['method'] not in ('GET', 'HEAD'):
+            return None
+        match = PROFILE_PATH.match(scope['path'])
+        if not match:
+            return None
+        if self.limiter is not None:
+            # Peek only; the view charges the request as usual
+            address = self.client_address(environ)
+            if not all(self.limiter.available(group, address) for group in PROFILE_RATE_GROUPS):
+                return None
+        return match.group(1)
+
+    async def _prefetch_profile(self, environ, username):
+        """Load a profile into environ without tying up a worker thread"""
+        if username in profile_cache:
+            return
+        columns = [getattr(MedicalProfile, field) for field in MedicalProfile.SERIALIZED_FIELDS]
+        try:
+            async with self.engine.connect() as conn:
+                row = (await conn.execute(select(*columns).where(MedicalProfile.username == username))).first()
+        except Exception as e:
+            # The Flask view will query synchronously instead
+            logger.warning(f"Async profile prefetch failed for {username}: {e}")
+            return
+        environ[PROFILE_PREFETCH_ENVIRON] = (username, MedicalProfile.serialize(row) if row is not None else None)
+
+    async def _call_wsgi(self, scope, receive, send):
+        body = SpooledTemporaryFile(max_size=65536)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, body)
+        username = self._should_prefetch(scope, environ)
+        if username is not None:
+            await self._prefetch_profile(environ, username)
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response['start'] = {
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+                }
+                return write
+
+            def write(data):
+                # Legacy WSGI write() callable
+                if 'start' in response:
+                    send_from_thread(response.pop('start'))
+                send_from_thread({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if 'start' in response:
+                        send_from_thread(response.pop('start'))
+                    if chunk:
+                        send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                if 'start' in response:
+                    send_from_thread(response.pop('start'))
+                send_from_thread({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+                body.close()
+
+        await loop.run_in_executor(self.executor, run)
+
+
+def create_app():
+    threads = int(os.environ.get("ASGI_THREADS", 32))
+    engine = None
+    if not isinstance(profile_cache, RedisProfileCache):
+        # A shared Redis cache is queried from the worker thread instead
+        with flask_app.app_context():
+            url = db.engine.url
+        engine = create_async_engine_for(url, int(os.environ.get("ASGI_DB_POOL_SIZE", 10)))
+    return ASGIApp(flask_app, threads=threads, engine=engine, limiter=flask_app.extensions.get('rate_limiter'),
+                   client_address=client_address_resolver(flask_app.wsgi_app))
+
+
+app = create_app()
@@ -0,0 +1,66 @@
+"""Compare scan throughput of sync gunicorn workers against the ASGI mode
+
+Runs the same scan and create flows against `gunicorn main:app` (sync
+workers) and `uvicorn asgi:app` with the same number of worker processes,
+at a client concurrency well above the worker count, which is where sync
+workers start queueing.
+
+    python benchmarks/asgi_vs_sync.py --workers 2 --clients 64 --iterations 1000
+
+Use --database-url with a real Postgres server for representative numbers.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from common import ROOT, prepare_schema, start_gunicorn, start_uvicorn, stop_server
+from flows import HTTPDriver, run_scenario, scenario_operations, seed_profiles
+
+SCENARIOS = ('scan_cold', 'scan_warm', 'create')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=10000, help='synthetic profiles to seed')
+    parser.add_argument('--iterations', type=int, default=1000, help='operations per scenario')
+    parser.add_argument('--workers', type=int, default=2, help='worker processes for both servers')
+    parser.add_argument('--clients', type=int, default=64, help='concurrent clients')
+    parser.add_argument('--database-url', help='database to run against (default: temporary SQLite file)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+    if args.iterations * 2 > args.profiles:
+        parser.error('--profiles must be at least twice --iterations so both servers scan distinct profiles')
+
+    os.environ['DATABASE_URL'] = args.database_url or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='asgi-bench-'), 'bench.db')}"
+    sys.path.insert(0, ROOT)
+    prepare_schema(dict(os.environ))
+    seed_profiles(args.profiles)
+    logging.disable(logging.INFO)
+
+    servers = (('sync', start_gunicorn), ('asgi', start_uvicorn))
+    results = []
+    for index, (mode, start) in enumerate(servers):
+        server, port = start(dict(os.environ), workers=args.workers)
+        try:
+            driver = HTTPDriver(port)
+            for scenario in SCENARIOS:
+                summary = run_scenario(driver, scenario_operations(scenario, args.iterations, index * args.iterations),
+                                       args.clients)
+                results.append({'mode': mode, 'scenario': scenario, 'clients': args.clients, **summary})
+                print(f"{mode:5} {scenario:10} {summary['rps']:>9.1f} req/s  p50 {summary['p50_ms']:>8.2f}ms  "
+                      f"p99 {summary['p99_ms']:>8.2f}ms  errors {summary['errors']}")
+        finally:
+            stop_server(server)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'workers': args.workers, 'results': results}, fp, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
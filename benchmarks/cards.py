@@ -0,0 +1,133 @@
+"""Printable card benchmark: single cards and clinic-wide N-up sheets
+
+Seeds synthetic profiles, then times single card requests (cold and cached)
+through the Flask test client and whole-clinic sheet runs with an empty
+card cache, with a warm one, and after a share of the profiles was edited
+(only those cards are redrawn).
+
+    python benchmarks/cards.py --profiles 1000 --workers 4 --output cards.json
+
+Exits non-zero if a request fails or a cached sheet rerenders any card.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from common import ROOT, prepare_schema, summarize
+
+ALLERGIES = ('penicillin', 'peanuts and tree nuts', 'latex, iodine contrast and shellfish', '', 'bee stings')
+CONDITIONS = ('asthma', 'type 1 diabetes', '', 'epilepsy; takes levetiracetam', 'atrial fibrillation on warfarin')
+
+
+def seed(count):
+    from sqlalchemy import func, insert, select
+    from models import db, MedicalProfile
+
+    existing = db.session.execute(
+        select(func.count()).select_from(MedicalProfile).where(MedicalProfile.username.like('card_%'))
+    ).scalar()
+    if existing < count:
+        db.session.execute(insert(MedicalProfile), [
+            {
+                'username': f'card_{i:06d}',
+                'name': f'Benchmark Patient {i}',
+                'blood_type': ('A+', 'O-', 'B+', 'AB-')[i % 4],
+                'allergy': ALLERGIES[i % len(ALLERGIES)],
+                'condition': CONDITIONS[i % len(CONDITIONS)],
+                'emergency_contact': f'Next of kin, 555-{i % 10000:04d}',
+            }
+            for i in range(existing, count)
+        ])
+        db.session.commit()
+
+
+def time_sheet(app, args):
+    from app import card_cache, card_style, profile_link
+    from cards import CARD_LAYOUTS, iter_cards, stream_sheets
+
+    misses = card_cache.misses
+    started = time.perf_counter()
+    size = 0
+    with app.test_request_context(base_url='https://example.org'):
+        for chunk in stream_sheets(iter_cards(), profile_link, CARD_LAYOUTS[args.layout], card_cache, args.format,
+                                   args.page, None, card_style, workers=args.workers):
+            size += len(chunk)
+    elapsed = time.perf_counter() - started
+    return {'seconds': round(elapsed, 3), 'bytes': size, 'rendered': card_cache.misses - misses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=1000, help='synthetic profiles to seed')
+    parser.add_argument('--iterations', type=int, default=100, help='single card requests per pass')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='render processes for sheets')
+    parser.add_argument('--layout', default='wallet', choices=('wallet', 'wristband'))
+    parser.add_argument('--format', default='pdf', choices=('pdf', 'zip'))
+    parser.add_argument('--page', default='a4', choices=('a4', 'letter'))
+    parser.add_argument('--edited', type=float, default=0.1, help='share of profiles edited before the last run')
+    parser.add_argument('--database-url', help='database to run against (default: temporary SQLite file)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='cards-bench-'), 'bench.db')}"
+    os.environ['CARD_CACHE_SIZE'] = str(max(args.profiles * 2, 2048))
+    prepare_schema(dict(os.environ))
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.WARNING)
+
+    from sqlalchemy import update
+    from app import app, card_cache
+    from models import db, MedicalProfile
+
+    with app.app_context():
+        seed(args.profiles)
+
+    client = app.test_client()
+    results, problems = {}, []
+    usernames = [f'card_{i:06d}' for i in range(args.iterations)]
+    for name in ('card_cold', 'card_cached'):
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for username in usernames:
+            request_started = time.perf_counter()
+            response = client.get(f'/card/{username}?layout={args.layout}')
+            latencies.append(time.perf_counter() - request_started)
+            errors += response.status_code != 200
+        results[name] = summarize(latencies, time.perf_counter() - started, errors)
+        if errors:
+            problems.append(f'{name}: {errors} failed requests')
+        print(f"{name:14} p50 {results[name]['p50_ms']:>8.2f}ms  p95 {results[name]['p95_ms']:>8.2f}ms")
+
+    with app.app_context():
+        card_cache.clear()
+        results['sheet_cold'] = time_sheet(app, args)
+        results['sheet_cached'] = time_sheet(app, args)
+        edited = int(args.profiles * args.edited)
+        db.session.execute(update(MedicalProfile)
+                           .where(MedicalProfile.username.in_([f'card_{i:06d}' for i in range(edited)]))
+                           .values(doctor_notes='Reviewed'))
+        db.session.commit()
+        results['sheet_after_edits'] = time_sheet(app, args)
+    if results['sheet_cached']['rendered']:
+        problems.append(f"cached sheet rerendered {results['sheet_cached']['rendered']} cards")
+    for name in ('sheet_cold', 'sheet_cached', 'sheet_after_edits'):
+        run = results[name]
+        print(f"{name:18} {run['seconds']:>8.2f}s  {run['rendered']:>6} rendered  {run['bytes'] / 1e6:>7.1f}MB")
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'meta': vars(args), 'results': results, 'problems': problems}, fp, indent=2)
+        print(f"Wrote {args.output}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Shared helpers for the benchmark scripts"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Every benchmark client comes from one address and would trip the per-client
+# rate limits; set RATE_LIMIT_ENABLED=1 to measure with the limiter on
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+# Pre-rendered QR files outlive a run; a fresh directory keeps cold scans cold
+os.environ.setdefault('QR_CACHE_DIR', tempfile.mkdtemp(prefix='qr-cache-bench-'))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start listening on port {port}")
+
+
+def prepare_schema(env):
+    """Create the schema once, before server workers start racing each other for it"""
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def start_gunicorn(env, workers=4, extra_args=(), app='main:app'):
+    """Start gunicorn on a free local port and return (process, port)"""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+         '--bind', f'127.0.0.1:{port}', *extra_args, app],
+        # The app sizes its pools and picks its profile cache from WEB_CONCURRENCY
+        cwd=ROOT, env={**env, 'WEB_CONCURRENCY': str(workers)}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        server.terminate()
+        raise
+    return server, port
+
+
+def start_uvicorn(env, workers=4, extra_args=(), app='asgi:app'):
+    """Start uvicorn on a free local port and return (process, port)"""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', '--workers', str(workers), '--log-level', 'warning',
+         '--host', '127.0.0.1', '--port', str(port), *extra_args, app],
+        cwd=ROOT, env={**env, 'WEB_CONCURRENCY': str(workers)}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        server.terminate()
+        raise
+    return server, port
+
+
+def stop_server(server):
+    server.terminate()
+    server.wait()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Summarize per-request latencies (seconds) into the benchmark result fields"""
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 4),
+        'rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if values else 0.0,
+    }
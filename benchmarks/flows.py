@@ -0,0 +1,208 @@
+"""Latency and throughput benchmark for the scan, create and edit flows
+
+Seeds synthetic profiles, then drives the app through the Flask test client
+(in-process, sequential) and a real gunicorn server (concurrent clients),
+reporting p50/p95/p99 latency and requests/sec for each flow:
+
+    scan_cold   first profile page + QR image fetch for a profile
+    scan_warm   the same scans again, served from warm caches
+    create      signup form POST
+    edit        checkup edit POST
+
+    python benchmarks/flows.py --profiles 10000 --iterations 500 --output results.json
+
+Results are written as JSON so runs can be compared. Uses a throwaway SQLite
+database unless --database-url is given.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from common import ROOT, prepare_schema, start_gunicorn, stop_server, summarize
+
+SCENARIOS = ('scan_cold', 'scan_warm', 'create', 'edit')
+USERNAME_FORMAT = 'bench_{:07d}'
+
+
+def seed_profiles(count, chunk_size=5000):
+    """Insert count synthetic profiles unless they are already present"""
+    from sqlalchemy import func, insert, select
+    from app import app
+    from models import db, MedicalProfile
+
+    with app.app_context():
+        existing = db.session.execute(
+            select(func.count()).select_from(MedicalProfile).where(MedicalProfile.username.like('bench_%'))
+        ).scalar()
+        for start in range(existing, count, chunk_size):
+            db.session.execute(insert(MedicalProfile), [
+                {
+                    'username': USERNAME_FORMAT.format(i),
+                    'name': f'Synthetic Patient {i}',
+                    'blood_type': ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')[i % 8],
+                    'allergy': 'penicillin' if i % 3 == 0 else 'none known',
+                    'condition': 'asthma' if i % 5 == 0 else '',
+                    'emergency_contact': f'Contact {i}, 555-{i % 10000:04d}',
+                }
+                for i in range(start, min(start + chunk_size, count))
+            ])
+            db.session.commit()
+
+
+class TestClientDriver:
+    """Issue requests through the Flask test client in this process"""
+
+    name = 'testclient'
+
+    def __init__(self):
+        from app import app
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None):
+        response = self.client.open(path, method=method, data=form)
+        response.close()
+        return response.status_code
+
+
+class HTTPDriver:
+    """Issue requests over HTTP to a running server"""
+
+    name = 'gunicorn'
+
+    def __init__(self, port):
+        self.port = port
+
+    def request(self, method, path, form=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            if form is None:
+                conn.request(method, path)
+            else:
+                conn.request(method, path, urlencode(form), {'Content-Type': 'application/x-www-form-urlencoded'})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+
+def scenario_operations(scenario, iterations, offset):
+    """Return a list of operations; each is a list of (method, path, form, expected status)"""
+    usernames = [USERNAME_FORMAT.format(offset + i) for i in range(iterations)]
+    if scenario in ('scan_cold', 'scan_warm'):
+        return [[('GET', f'/profile/{u}', None, 200), ('GET', f'/qr/{u}', None, 200)] for u in usernames]
+    if scenario == 'create':
+        form = {'name': 'Benchmark Patient', 'emergency_contact': '555-0100', 'blood_type': 'O+'}
+        return [[('POST', '/', form, 302)] for _ in range(iterations)]
+    return [[('POST', f'/edit/{u}', {'last_checkup_date': '2025-01-01', 'last_checkup_details': f'Run {i}'}, 302)]
+            for i, u in enumerate(usernames)]
+
+
+def run_scenario(driver, operations, clients):
+    """Run operations with the given concurrency and return the summary"""
+    def run(operation):
+        started = time.perf_counter()
+        ok = all(driver.request(method, path, form) == expected for method, path, form, expected in operation)
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    if clients <= 1:
+        results = [run(operation) for operation in operations]
+    else:
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            results = list(executor.map(run, operations))
+    elapsed = time.perf_counter() - started
+    return summarize([latency for latency, _ in results], elapsed, errors=sum(not ok for _, ok in results))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=10000, help='synthetic profiles to seed')
+    parser.add_argument('--iterations', type=int, default=500, help='operations per scenario')
+    parser.add_argument('--driver', choices=('testclient', 'gunicorn', 'both'), default='both')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients against gunicorn')
+    parser.add_argument('--gunicorn-args', default='', help='extra arguments passed to gunicorn')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated scenarios to run')
+    parser.add_argument('--database-url', help='database to run against (default: temporary SQLite file)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.iterations * 2 > args.profiles:
+        parser.error('--profiles must be at least twice --iterations so drivers scan distinct profiles')
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='flows-bench-'), 'bench.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    sys.path.insert(0, ROOT)
+    prepare_schema(dict(os.environ))
+    seed_profiles(args.profiles)
+    logging.disable(logging.INFO)
+
+    drivers = ['testclient', 'gunicorn'] if args.driver == 'both' else [args.driver]
+    results = []
+    for index, driver_name in enumerate(drivers):
+        # Each driver scans its own slice of profiles so the cold runs are really cold
+        offset = index * args.iterations
+        server = None
+        if driver_name == 'testclient':
+            driver, clients = TestClientDriver(), 1
+        else:
+            server, port = start_gunicorn(dict(os.environ), workers=args.workers,
+                                          extra_args=args.gunicorn_args.split())
+            driver, clients = HTTPDriver(port), args.clients
+        try:
+            for scenario in scenarios:
+                summary = run_scenario(driver, scenario_operations(scenario, args.iterations, offset), clients)
+                results.append({'driver': driver_name, 'scenario': scenario, 'clients': clients, **summary})
+                print(f"{driver_name:10} {scenario:10} {summary['rps']:>9.1f} req/s  "
+                      f"p50 {summary['p50_ms']:>8.2f}ms  p95 {summary['p95_ms']:>8.2f}ms  "
+                      f"p99 {summary['p99_ms']:>8.2f}ms  errors {summary['errors']}")
+        finally:
+            if server is not None:
+                stop_server(server)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'database': database_url.split(':', 1)[0],
+            'profiles': args.profiles,
+            'iterations': args.iterations,
+            'workers': args.workers,
+            'gunicorn_args': args.gunicorn_args,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+        print(f"Wrote {args.output}")
+    if any(result['errors'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
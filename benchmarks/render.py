@@ -0,0 +1,128 @@
+"""Page render micro-benchmark, per route
+
+For each HTML route this times the template render alone (render_template in
+a request context, with the profile already loaded) and the whole request
+through the Flask test client, with the rendered page cache disabled so every
+profile request renders. It also reports the page size and the time to
+compile each template from source, which the bytecode cache saves new worker
+processes.
+
+    python benchmarks/render.py --iterations 2000 --output render.json
+    TEMPLATE_MINIFY=0 python benchmarks/render.py   # compare unminified output
+
+Exits non-zero if a route does not answer with its expected status.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from common import ROOT, prepare_schema, summarize
+
+USERNAME = 'render_probe'
+PROFILE = {
+    'username': USERNAME,
+    'name': 'Render Probe',
+    'blood_type': 'AB-',
+    'allergy': 'Penicillin, shellfish <severe>',
+    'condition': 'Type 1 diabetes & asthma',
+    'emergency_contact': 'Sam Probe, 555-0100',
+    'last_checkup_details': 'Routine bloods normal.\nHbA1c 6.9%',
+    'doctor_notes': 'Carries an insulin pen and an inhaler.',
+}
+
+
+def seed_probe_profile():
+    from datetime import date
+    from models import db, MedicalProfile
+
+    if not MedicalProfile.query.filter_by(username=USERNAME).first():
+        db.session.add(MedicalProfile(last_checkup_date=date(2025, 1, 15), **PROFILE))
+        db.session.commit()
+
+
+def time_calls(func, iterations):
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000, help='renders and requests per route')
+    parser.add_argument('--database-url', help='database to run against (default: temporary SQLite file)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='render-bench-'), 'bench.db')}"
+    os.environ['PAGE_CACHE_SIZE'] = '0'
+    prepare_schema(dict(os.environ))
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.WARNING)
+
+    from flask import render_template, url_for
+    from app import app
+    from models import MedicalProfile
+
+    with app.app_context():
+        seed_probe_profile()
+        profile = MedicalProfile.query.filter_by(username=USERNAME).first()
+        info = profile.to_dict()
+
+    env = app.jinja_env
+    # (route, template, context, path, expected status)
+    routes = (
+        ('form', 'form.html', lambda: {}, '/', 200),
+        ('profile', 'profile.html',
+         lambda: {'info': info, 'username': USERNAME, 'qr_code_url': url_for('qr_code', username=USERNAME)},
+         f'/profile/{USERNAME}', 200),
+        ('edit_checkup', 'edit_checkup.html', lambda: {'info': profile, 'username': USERNAME},
+         f'/edit/{USERNAME}', 200),
+        ('not_found', 'not_found.html', lambda: {'username': 'nobody'}, '/profile/nobody', 404),
+    )
+
+    client = app.test_client()
+    results, problems = [], []
+    for name, template, context, path, status in routes:
+        source = env.loader.get_source(env, template)[0]
+        started = time.perf_counter()
+        env.compile(source, template)
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        with app.test_request_context(path):
+            values = context()
+            body = render_template(template, **values)
+            render = time_calls(lambda: render_template(template, **values), args.iterations)
+
+        response = client.get(path)
+        if response.status_code != status:
+            problems.append(f'{path}: {response.status_code}, expected {status}')
+        request = time_calls(lambda: client.get(path).close(), args.iterations)
+
+        results.append({'route': name, 'template': template, 'bytes': len(body.encode()),
+                        'compile_ms': round(compile_ms, 3), 'render': render, 'request': request})
+        print(f"{name:13} render p50 {render['p50_ms']:>7.3f}ms p95 {render['p95_ms']:>7.3f}ms  "
+              f"request p50 {request['p50_ms']:>7.3f}ms  {len(body.encode()):>6} bytes  "
+              f"compile {compile_ms:>6.2f}ms")
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'meta': {'iterations': args.iterations, 'minify': app.config["TEMPLATE_MINIFY"]},
+                       'results': results, 'problems': problems}, fp, indent=2)
+        print(f"Wrote {args.output}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
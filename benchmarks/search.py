@@ -0,0 +1,185 @@
+"""Profile search benchmark on a large seeded table
+
+Seeds synthetic profiles (a million by default), builds the search index with
+init_db, then times searches through /api/v1/profiles/search and checks each
+query plan: the search must be answered from the full-text index, never by
+scanning medical_profiles. Unindexed ILIKE scans for a common and a missing
+term are timed for comparison.
+
+    python benchmarks/search.py --rows 1000000 --iterations 50 --output search.json
+
+Exits non-zero if any search plan scans the profile table.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from common import ROOT, summarize
+
+FIRST_NAMES = ('Ana', 'Ben', 'Chloe', 'David', 'Elena', 'Farid', 'Grace', 'Hugo', 'Ines', 'Jamal', 'Kenji',
+               'Lena', 'Mateo', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Samir', 'Tara', 'Uma', 'Victor')
+LAST_NAMES = ('Garcia', 'Smith', 'Okafor', 'Nguyen', 'Kowalski', 'Haddad', 'Silva', 'Tanaka', 'Muller',
+              'Rossi', 'Dubois', 'Khan', 'Jensen', 'Moreno', 'Ivanova', 'Mensah', 'Park', 'Novak')
+# (value, weight): penicillin is common, latex is rare
+ALLERGIES = (('none known', 60), ('penicillin', 12), ('peanuts', 8), ('shellfish', 6), ('sulfa drugs', 5),
+             ('aspirin', 4), ('amoxicillin', 3), ('bee stings', 1.9), ('latex', 0.1))
+CONDITIONS = (('', 55), ('asthma', 12), ('type 2 diabetes', 10), ('hypertension', 10), ('epilepsy', 4),
+              ('atrial fibrillation', 4), ('chronic kidney disease', 3), ('haemophilia', 2))
+
+QUERIES = (
+    ('rare_term', 'latex', None),
+    ('common_term', 'penicillin', None),
+    ('field_scoped', 'penicillin', 'allergy'),
+    ('prefix', 'peni', 'allergy'),
+    ('multi_term', 'asthma penicillin', None),
+    ('name', 'garcia', 'name'),
+)
+
+
+def seed(count, chunk_size=10000):
+    """Insert count synthetic profiles unless they are already present"""
+    from sqlalchemy import func, insert, select
+    from models import db, MedicalProfile
+
+    rng = random.Random(42)
+    allergies, allergy_weights = zip(*ALLERGIES)
+    conditions, condition_weights = zip(*CONDITIONS)
+    existing = db.session.execute(
+        select(func.count()).select_from(MedicalProfile).where(MedicalProfile.username.like('search_%'))
+    ).scalar()
+    for start in range(existing, count, chunk_size):
+        size = min(chunk_size, count - start)
+        db.session.execute(insert(MedicalProfile), [
+            {
+                'username': f'search_{i:07d}',
+                'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                'allergy': allergy,
+                'condition': condition,
+            }
+            for i, allergy, condition in zip(range(start, start + size),
+                                             rng.choices(allergies, allergy_weights, k=size),
+                                             rng.choices(conditions, condition_weights, k=size))
+        ])
+        db.session.commit()
+        print(f"\rSeeded {start + size} rows", end='', file=sys.stderr)
+    print(file=sys.stderr)
+
+
+def query_plan(stmt):
+    """Return the database's plan for stmt as text lines"""
+    from sqlalchemy import text
+    from models import db
+
+    dialect = db.engine.dialect
+    sql = str(stmt.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        return [row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+    return [row[0] for row in db.session.execute(text('EXPLAIN ' + sql))]
+
+
+def scans_table(plan):
+    """True if the plan reads medical_profiles sequentially rather than through an index"""
+    pattern = re.compile(r'(^|\s)(SCAN medical_profiles\b(?!_fts)|Seq Scan on medical_profiles\b)')
+    return any(pattern.search(line) for line in plan)
+
+
+def time_requests(client, path, iterations):
+    latencies, errors, body = [], 0, None
+    started = time.perf_counter()
+    for _ in range(iterations):
+        request_started = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - request_started)
+        errors += response.status_code != 200
+        body = response.get_json()
+    return summarize(latencies, time.perf_counter() - started, errors), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='synthetic profiles to seed')
+    parser.add_argument('--iterations', type=int, default=50, help='requests per search query')
+    parser.add_argument('--limit', type=int, default=100, help='page size requested')
+    parser.add_argument('--scan-iterations', type=int, default=3, help='runs of the unindexed comparison query')
+    parser.add_argument('--database-url', help='database to run against (default: temporary SQLite file)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='search-bench-'), 'bench.db')}"
+    os.environ['API_TOKEN'] = 'search-bench'
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.INFO)
+
+    from sqlalchemy import text
+    from api import _select
+    from app import app, init_db
+    from models import db, MedicalProfile
+    from profile_search import search_statement, search_terms
+
+    with app.app_context():
+        db.create_all()
+        seed(args.rows)
+        started = time.perf_counter()
+        init_db()
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        print(f"Search index ready in {time.perf_counter() - started:.1f}s")
+        dialect = db.engine.dialect.name
+
+        client = app.test_client()
+        client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer search-bench'
+        fields = ('id', 'username', 'name', 'allergy', 'condition')
+        results, problems = [], []
+        for name, query, field in QUERIES:
+            path = f'/api/v1/profiles/search?q={query}&limit={args.limit}' + (f'&field={field}' if field else '')
+            pages = [('first_page', path)]
+            summary, body = time_requests(client, path, args.iterations)
+            after = body['next_after'] if body else None
+            if after:
+                pages.append(('next_page', f'{path}&after={after}'))
+            for page, page_path in pages:
+                if page == 'next_page':
+                    summary, _ = time_requests(client, page_path, args.iterations)
+                plan = query_plan(search_statement(_select(fields), dialect, search_terms(query), field,
+                                                   after if page == 'next_page' else 0, args.limit))
+                indexed = not scans_table(plan)
+                if not indexed:
+                    problems.append(f'{name} {page} scans medical_profiles: {plan}')
+                results.append({'query': name, 'q': query, 'field': field, 'page': page, 'indexed': indexed,
+                                 'plan': plan, **summary})
+                print(f"{name:13} {page:10} p50 {summary['p50_ms']:>8.2f}ms  p95 {summary['p95_ms']:>8.2f}ms  "
+                      f"{'index' if indexed else 'SEQ SCAN'}")
+
+        # Unindexed ILIKE for scale: a common term stops early, a missing term reads every row
+        scans = {}
+        for name, term in (('ilike_common', 'penicillin'), ('ilike_miss', 'nosuchterm')):
+            stmt = search_statement(_select(fields), 'generic', [term], None, 0, args.limit)
+            latencies = []
+            for _ in range(args.scan_iterations):
+                started = time.perf_counter()
+                db.session.execute(stmt).all()
+                latencies.append(time.perf_counter() - started)
+            scans[name] = summarize(latencies, sum(latencies))
+            print(f"{name:13} {'':10} p50 {scans[name]['p50_ms']:>8.2f}ms")
+        rows = db.session.query(MedicalProfile).count()
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'meta': {'rows': rows, 'database': dialect, 'limit': args.limit},
+                       'results': results, 'unindexed': scans, 'problems': problems}, fp, indent=2)
+        print(f"Wrote {args.output}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
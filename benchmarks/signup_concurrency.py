@@ -0,0 +1,75 @@
+"""Concurrent profile creation benchmark against a real gunicorn server
+
+Starts gunicorn with several workers and fires profile creations at it from
+many client threads, all requesting the same username (or none) so every
+request after the first has to be resolved by the username allocator.
+
+    python benchmarks/signup_concurrency.py --workers 4 --clients 32 --requests 2000
+
+Uses a throwaway SQLite database unless --database-url is given; SQLite
+serialises writers, so use Postgres for meaningful numbers.
+"""
+import argparse
+import http.client
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from common import prepare_schema, start_gunicorn, stop_server
+
+
+def create_profile(port, username):
+    """POST the signup form and return (status, location)"""
+    body = urlencode({'name': 'Benchmark Patient', 'username': username, 'emergency_contact': '555-0100'})
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('POST', '/', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        return response.status, response.getheader('Location')
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent client threads')
+    parser.add_argument('--requests', type=int, default=1000, help='total profiles to create')
+    parser.add_argument('--username', default='clinic', help='username every request asks for ("" to auto-generate)')
+    parser.add_argument('--database-url', help='database to run against (default: temporary SQLite file)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='signup-bench-')
+    env = dict(os.environ)
+    env['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+
+    prepare_schema(env)
+    server, port = start_gunicorn(env, workers=args.workers)
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            results = list(executor.map(lambda _: create_profile(port, args.username), range(args.requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        stop_server(server)
+
+    statuses = Counter(status for status, _ in results)
+    locations = [location for status, location in results if status == 302]
+    created = len(locations)
+    print(f"workers={args.workers} clients={args.clients} requests={args.requests}")
+    print(f"created {created} profiles in {elapsed:.2f}s ({created / elapsed:.1f} creates/sec)")
+    print(f"statuses: {dict(statuses)}")
+    print(f"distinct usernames: {len(set(locations))}")
+    failed = args.requests - created
+    if failed or len(set(locations)) != created:
+        print(f"FAILED: {failed} requests did not create a unique profile")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Cold start benchmark: app import time and first-request latency
+
+Each run starts a fresh interpreter that imports the app, then serves the
+first profile page, the first QR image and a second profile page through the
+Flask test client. It also checks what the import itself did: no database
+connections and no QR/imaging modules should be loaded before the first
+request needs them. A final pass boots gunicorn and times how long it takes
+to answer its first request.
+
+    python benchmarks/startup.py --runs 10 --max-import-ms 1500 --output startup.json
+
+Exits non-zero if the import connects to the database, loads qrcode or
+Pillow, or takes longer than --max-import-ms (median).
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, free_port, prepare_schema, stop_server
+
+USERNAME = 'startup_probe'
+
+# Runs in a fresh interpreter so nothing is already imported or connected
+PROBE = f"""
+import json, sys, time
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+connections = []
+event.listen(Pool, 'connect', lambda *args: connections.append(time.perf_counter()))
+
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+result = {{
+    'import_ms': (imported - started) * 1000,
+    'import_connections': len(connections),
+    'qrcode_loaded': 'qrcode' in sys.modules,
+    'pil_loaded': 'PIL.Image' in sys.modules,
+}}
+
+client = app.app.test_client()
+for key, path in (('first_profile_ms', '/profile/{USERNAME}'), ('first_qr_ms', '/qr/{USERNAME}'),
+                  ('second_profile_ms', '/profile/{USERNAME}')):
+    started = time.perf_counter()
+    response = client.get(path)
+    response.close()
+    result[key] = (time.perf_counter() - started) * 1000
+    if response.status_code != 200:
+        result.setdefault('errors', []).append(f'{{path}}: {{response.status_code}}')
+print(json.dumps(result))
+"""
+
+
+def seed_probe_profile(env):
+    code = (
+        "from app import app, db\n"
+        "from models import MedicalProfile\n"
+        "with app.app_context():\n"
+        f"    if not MedicalProfile.query.filter_by(username='{USERNAME}').first():\n"
+        f"        db.session.add(MedicalProfile(username='{USERNAME}', name='Startup Probe',"
+        " emergency_contact='555-0100'))\n"
+        "        db.session.commit()\n"
+    )
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True)
+
+
+def run_probe(env):
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def gunicorn_first_response(env, workers):
+    """Seconds from spawning gunicorn until it answers its first profile page"""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}', 'main:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = started + 60
+        while time.perf_counter() < deadline:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            try:
+                conn.request('GET', f'/profile/{USERNAME}')
+                response = conn.getresponse()
+                response.read()
+                if response.status == 200:
+                    return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+            finally:
+                conn.close()
+        raise RuntimeError("gunicorn did not answer within 60s")
+    finally:
+        stop_server(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters to measure')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers for the boot measurement')
+    parser.add_argument('--max-import-ms', type=float, help='fail if the median import time exceeds this')
+    parser.add_argument('--skip-gunicorn', action='store_true', help='only measure in-process startup')
+    parser.add_argument('--database-url', help='database to run against (default: temporary SQLite file)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = args.database_url or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='startup-bench-'), 'bench.db')}"
+    # first_qr_ms is a cold render, not a read from the shared on-disk QR cache
+    env['QR_CACHE_DIR'] = ''
+    prepare_schema(env)
+    seed_probe_profile(env)
+
+    runs = [run_probe(env) for _ in range(args.runs)]
+    summary = {
+        key: round(statistics.median(run[key] for run in runs), 2)
+        for key in ('import_ms', 'first_profile_ms', 'first_qr_ms', 'second_profile_ms')
+    }
+    summary['import_ms_max'] = round(max(run['import_ms'] for run in runs), 2)
+    if not args.skip_gunicorn:
+        summary['gunicorn_first_response_ms'] = round(gunicorn_first_response(env, args.workers) * 1000, 2)
+
+    problems = sorted({error for run in runs for error in run.get('errors', [])})
+    if any(run['import_connections'] for run in runs):
+        problems.append('importing the app opened a database connection')
+    if any(run['qrcode_loaded'] or run['pil_loaded'] for run in runs):
+        problems.append('importing the app loaded qrcode/Pillow')
+    if args.max_import_ms and summary['import_ms'] > args.max_import_ms:
+        problems.append(f"median import time {summary['import_ms']}ms exceeds {args.max_import_ms}ms")
+
+    for key, value in summary.items():
+        print(f"{key:28} {value:>10.2f}")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'summary': summary, 'runs': runs, 'problems': problems}, fp, indent=2)
+        print(f"Wrote {args.output}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -33,14 +33,9 @@ chmod -R 755 static/
 # Only run database setup if DATABASE_URL is available
 if [ -n "$DATABASE_URL" ]; then
     echo "DATABASE_URL found, setting up database..."
-    python -c "
-from app import app, db
-with app.app_context():
-    db.create_all()
-    print('Database tables created successfully')
-"
+    flask --app app init-db
 else
-    echo "DATABASE_URL not found, skipping database setup (will be handled at runtime)"
+    echo "DATABASE_URL not found, skipping database setup (run 'flask --app app init-db' before serving)"
 fi
 
 echo "Build completed successfully"
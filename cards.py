@@ -0,0 +1,476 @@
+"""Printable emergency cards: wallet cards and wristband inserts, singly or N-up on sheets
+
+A card shows the profile's QR code, name, blood type, allergies, conditions
+and emergency contact, drawn at 300 dpi with Pillow. Rendered cards are
+kept in a CardCache as zlib-compressed RGB bitmaps, keyed by username and
+layout and tagged with the profile's updated_at and the link in its QR code,
+so an edited profile (or a card for another link) is redrawn and an
+unchanged one never is. Fonts, the logo, each layout's title
+band and QR bitmaps are loaded or drawn once per process and reused by
+every card.
+
+Sheets lay cards out in a grid on A4 or Letter pages. A cached bitmap is
+already a valid PDF Flate stream, so building a PDF sheet only places
+compressed images; PNG is encoded only for single cards and PNG sheets.
+Card rendering is spread over a process pool like bulk QR generation.
+"""
+import os
+import time
+import zipfile
+import zlib
+from collections import deque
+from functools import lru_cache, partial
+from io import BytesIO
+from itertools import islice
+
+from sqlalchemy import select
+
+from lru import LRUCache
+from models import db, MedicalProfile
+from qr_batch import PDFWriter, StreamBuffer, chunked, parallel_map
+from qr_cache import make_qr
+
+DPI = 300
+MM_PER_INCH = 25.4
+POINTS_PER_INCH = 72
+
+CARD_FORMATS = {
+    'png': 'image/png',
+    'pdf': 'application/pdf',
+}
+# Sheets come as one PDF or as a ZIP of one PNG per page
+SHEET_FORMATS = {
+    'pdf': 'application/pdf',
+    'zip': 'application/zip',
+}
+PAGE_SIZES = {
+    'a4': (210, 297),
+    'letter': (215.9, 279.4),
+}
+PAGE_MARGIN_MM = 10
+CARD_GAP_MM = 4
+
+# Profile columns a card needs
+CARD_FIELDS = ('username', 'name', 'blood_type', 'allergy', 'condition', 'emergency_contact', 'updated_at')
+
+# Cards handed to a worker process at a time
+RENDER_CHUNK_SIZE = 32
+
+RED = (198, 40, 40)
+BLACK = (0, 0, 0)
+GREY = (90, 90, 90)
+WHITE = (255, 255, 255)
+
+# Tried in order when no font is configured; Pillow's built-in font is the last
+# resort and only covers ASCII, so set CARD_FONT for accented or non-Latin names
+FONT_CANDIDATES = (
+    ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+     '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf'),
+    ('/usr/share/fonts/dejavu/DejaVuSans.ttf', '/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf'),
+    ('/Library/Fonts/Arial Unicode.ttf', '/Library/Fonts/Arial Unicode.ttf'),
+)
+
+
+class CardLayout:
+    """Physical size of a card, and its pixel size at DPI"""
+
+    def __init__(self, name, width_mm, height_mm):
+        self.name = name
+        self.width_mm = width_mm
+        self.height_mm = height_mm
+        self.width = round(width_mm / MM_PER_INCH * DPI)
+        self.height = round(height_mm / MM_PER_INCH * DPI)
+
+
+CARD_LAYOUTS = {
+    # ISO/IEC 7810 ID-1, the size of a bank card
+    'wallet': CardLayout('wallet', 85.6, 53.98),
+    # Insert for a standard 1 inch patient wristband
+    'wristband': CardLayout('wristband', 200, 25.4),
+}
+
+
+def find_card_fonts(font=None, bold_font=None):
+    """Return (regular, bold) font files: the given ones, else the first installed candidate"""
+    if font is None:
+        font, bold_font = next(((regular, bold) for regular, bold in FONT_CANDIDATES
+                                if os.path.exists(regular)), (None, bold_font))
+    return font, bold_font or font
+
+
+class CardStyle:
+    """Font and logo files for cards; None uses Pillow's built-in font and no logo
+
+    Font files are used as given; see find_card_fonts for the system fallback.
+    """
+
+    def __init__(self, font=None, bold_font=None, logo=None):
+        self.font = font
+        self.bold_font = bold_font or font
+        self.logo = logo
+
+    # Compared by value, so copies sent to render workers share cached assets
+    def _key(self):
+        return self.font, self.bold_font, self.logo
+
+    def __eq__(self, other):
+        return isinstance(other, CardStyle) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+
+class CardCache(LRUCache):
+    """Bounded, thread-safe LRU of rendered card bitmaps
+
+    Entries are keyed by (username, layout) and remember the version (see
+    card_version) they were drawn from; a lookup with a different version is
+    a miss and drops the stale card.
+    """
+
+    def __init__(self, max_entries=2048):
+        super().__init__(max_entries)
+
+    def get(self, username, layout, version):
+        """Return the cached bitmap for this profile version, or None"""
+        entry = self.lookup((username, layout), valid=lambda entry: entry[0] == version)
+        return entry[1] if entry is not None else None
+
+    def set(self, username, layout, version, bitmap):
+        self.store((username, layout), (version, bitmap))
+
+
+def card_version(card, link):
+    """The cache version of a card: its profile's updated_at and the link in its QR code"""
+    updated_at = card.get('updated_at')
+    if updated_at is None:
+        updated_at = ''
+    elif not isinstance(updated_at, str):
+        updated_at = updated_at.isoformat()
+    return updated_at, link
+
+
+def iter_cards(usernames=None, chunk_size=1000):
+    """Yield card data dicts for all (or the given) profiles in id order, reading in chunks"""
+    columns = [getattr(MedicalProfile, field) for field in CARD_FIELDS]
+    if usernames is None:
+        stmt = select(*columns).order_by(MedicalProfile.id).execution_options(yield_per=chunk_size)
+        for row in db.session.execute(stmt):
+            yield row._asdict()
+        return
+
+    usernames = iter(usernames)
+    while chunk := list(islice(usernames, chunk_size)):
+        stmt = select(*columns).where(MedicalProfile.username.in_(chunk)).order_by(MedicalProfile.id)
+        for row in db.session.execute(stmt):
+            yield row._asdict()
+
+
+@lru_cache(maxsize=64)
+def _font(path, size):
+    from PIL import ImageFont
+
+    if path:
+        return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size)
+
+
+@lru_cache(maxsize=8)
+def _logo(path, height):
+    from PIL import Image
+
+    with Image.open(path) as logo:
+        logo = logo.convert('RGBA')
+        width = max(1, round(logo.width * height / logo.height))
+        return logo.resize((width, height), Image.LANCZOS)
+
+
+@lru_cache(maxsize=16)
+def _wallet_base(layout, style):
+    """The wallet card background: white card with the red title band and logo"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (layout.width, layout.height), WHITE)
+    draw = ImageDraw.Draw(image)
+    pad = layout.height // 20
+    band = layout.height // 6
+    draw.rectangle((0, 0, layout.width, band), fill=RED)
+    x = pad
+    if style.logo:
+        logo = _logo(style.logo, band - pad)
+        image.paste(logo, (pad, pad // 2), logo)
+        x += logo.width + pad // 2
+    draw.text((x, band // 2), 'EMERGENCY MEDICAL INFORMATION', font=_font(style.bold_font, band // 2),
+              fill=WHITE, anchor='lm')
+    return image
+
+
+@lru_cache(maxsize=4096)
+def _qr_image(link, size):
+    """The QR code for link as a black on white image at most size pixels square"""
+    qr = make_qr(link, box_size=1)
+    # Whole pixels per module keep the code sharp when printed
+    qr.box_size = max(1, size // (qr.modules_count + 2 * qr.border))
+    return qr.make_image(fill_color="black", back_color="white").get_image().convert('RGB')
+
+
+def _fit_lines(draw, text, font, width, max_lines):
+    """Word-wrap text into at most max_lines lines of width pixels, ending in an ellipsis if cut"""
+    words = (text or '').split()
+    lines = []
+    while words and len(lines) < max_lines:
+        line = words.pop(0)
+        while words and draw.textlength(f'{line} {words[0]}', font=font) <= width:
+            line = f'{line} {words.pop(0)}'
+        lines.append(line)
+    if lines and (words or draw.textlength(lines[-1], font=font) > width):
+        last = lines[-1]
+        while last and draw.textlength(last + '…', font=font) > width:
+            last = last[:-1]
+        lines[-1] = last.rstrip() + '…'
+    return lines
+
+
+def render_card(card, link, layout, style=None):
+    """Draw one card as an RGB image"""
+    from PIL import Image, ImageDraw
+
+    style = style or CardStyle()
+    if layout.width > layout.height * 4:
+        image = Image.new('RGB', (layout.width, layout.height), WHITE)
+        draw = ImageDraw.Draw(image)
+        pad = layout.height // 16
+        # Wristband: QR code at the left, two lines of text beside it
+        qr = _qr_image(link, layout.height - 2 * pad)
+        image.paste(qr, (pad, (layout.height - qr.height) // 2))
+        x = pad * 2 + qr.width
+        width = layout.width - x - pad
+        title_font = _font(style.bold_font, (layout.height - 3 * pad) // 2)
+        text_font = _font(style.font, int(title_font.size * 0.8))
+        details = '; '.join(filter(None, (
+            card['allergy'] and f"Allergies: {card['allergy']}",
+            card['condition'] and f"Conditions: {card['condition']}",
+            card['emergency_contact'] and f"ICE: {card['emergency_contact']}",
+        )))
+        if card['blood_type']:
+            # Blood type keeps its place at the right end however long the name is
+            blood_type = f"Blood {card['blood_type']}"
+            blood_width = draw.textlength(blood_type, font=title_font)
+            draw.text((layout.width - pad - blood_width, pad), blood_type, font=title_font, fill=RED)
+            width_for_name = width - blood_width - pad
+        else:
+            width_for_name = width
+        for line in _fit_lines(draw, card['name'], title_font, width_for_name, 1):
+            draw.text((x, pad), line, font=title_font, fill=BLACK)
+        for line in _fit_lines(draw, details, text_font, width, 1):
+            draw.text((x, 2 * pad + title_font.size), line, font=text_font, fill=RED)
+        return image
+
+    # Wallet card: red title band, details on the left, QR code on the right
+    image = _wallet_base(layout, style).copy()
+    draw = ImageDraw.Draw(image)
+    pad = layout.height // 20
+    band = layout.height // 6
+
+    qr = _qr_image(link, layout.height - band - 2 * pad)
+    qr_x = layout.width - pad - qr.width
+    image.paste(qr, (qr_x, band + (layout.height - band - qr.height) // 2))
+
+    width = qr_x - 2 * pad
+    y = band + pad
+    name_font = _font(style.bold_font, layout.height // 10)
+    for line in _fit_lines(draw, card['name'] or '', name_font, width, 2):
+        draw.text((pad, y), line, font=name_font, fill=BLACK)
+        y += int(name_font.size * 1.15)
+
+    label_font = _font(style.font, layout.height // 24)
+    text_font = _font(style.font, layout.height // 17)
+    if card['blood_type']:
+        y += pad // 2
+        draw.text((pad, y), 'BLOOD TYPE', font=label_font, fill=GREY)
+        blood_font = _font(style.bold_font, layout.height // 8)
+        draw.text((pad + draw.textlength('BLOOD TYPE ', font=label_font), y - blood_font.size // 3),
+                  card['blood_type'], font=blood_font, fill=RED)
+        y += int(blood_font.size * 1.1)
+
+    contact_y = layout.height - pad - text_font.size
+    for label, value, color in (('ALLERGIES', card['allergy'], RED), ('CONDITIONS', card['condition'], BLACK)):
+        room = (contact_y - y - label_font.size) // int(text_font.size * 1.2)
+        if not value or room < 1:
+            continue
+        draw.text((pad, y), label, font=label_font, fill=GREY)
+        y += int(label_font.size * 1.3)
+        for line in _fit_lines(draw, value, text_font, width, min(room, 3)):
+            draw.text((pad, y), line, font=text_font, fill=color)
+            y += int(text_font.size * 1.2)
+        y += pad // 3
+
+    if card['emergency_contact']:
+        contact = _fit_lines(draw, f"ICE: {card['emergency_contact']}", text_font, width, 1)[0]
+        draw.text((pad, contact_y), contact, font=text_font, fill=BLACK)
+    return image
+
+
+def encode_bitmap(image):
+    """Compress a card image to the cached (width, height, zlib RGB data) form"""
+    # Fastest level: cards are flat colour and level 6 takes three times as long
+    return image.width, image.height, zlib.compress(image.tobytes(), 1)
+
+
+def decode_bitmap(bitmap):
+    from PIL import Image
+
+    width, height, data = bitmap
+    return Image.frombytes('RGB', (width, height), zlib.decompress(data))
+
+
+def encode_png(image):
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', compress_level=3)
+    return buffer.getvalue()
+
+
+def card_png(bitmap):
+    """Encode a cached card bitmap as PNG"""
+    return encode_png(decode_bitmap(bitmap))
+
+
+def _add_bitmap(pdf, bitmap):
+    width, height, data = bitmap
+    return pdf.add_image(width, height, data, 'DeviceRGB', 8)
+
+
+def _render_chunk(jobs, layout, style):
+    """Render a chunk of (card, link) jobs inside a worker process"""
+    layout = CARD_LAYOUTS[layout]
+    return [encode_bitmap(render_card(card, link, layout, style)) for card, link in jobs]
+
+
+def get_card(card, link, layout, cache, style=None):
+    """Return the bitmap for one card, from the cache when the profile is unchanged"""
+    version = card_version(card, link)
+    bitmap = cache.get(card['username'], layout.name, version)
+    if bitmap is None:
+        bitmap = encode_bitmap(render_card(card, link, layout, style))
+        cache.set(card['username'], layout.name, version, bitmap)
+    return bitmap
+
+
+def card_pdf(bitmap, layout):
+    """Wrap one card bitmap in a single-page PDF the size of the card"""
+    buffer = StreamBuffer()
+    pdf = PDFWriter(buffer)
+    width = layout.width_mm / MM_PER_INCH * POINTS_PER_INCH
+    height = layout.height_mm / MM_PER_INCH * POINTS_PER_INCH
+    pdf.add_sheet(width, height, [(_add_bitmap(pdf, bitmap), 0, 0, width, height)])
+    pdf.close()
+    return buffer.drain()
+
+
+def sheet_slots(layout, page='a4', per_page=None):
+    """Return (page width, page height, card positions) in mm, positions from the top left
+
+    The page is turned to landscape when that fits more cards. per_page
+    caps the cards per page; it cannot exceed what fits.
+    """
+    best = None
+    for width, height in (PAGE_SIZES[page], PAGE_SIZES[page][::-1]):
+        columns = int((width - 2 * PAGE_MARGIN_MM + CARD_GAP_MM) // (layout.width_mm + CARD_GAP_MM))
+        rows = int((height - 2 * PAGE_MARGIN_MM + CARD_GAP_MM) // (layout.height_mm + CARD_GAP_MM))
+        if best is None or columns * rows > best[2] * best[3]:
+            best = (width, height, columns, rows)
+    width, height, columns, rows = best
+    if columns * rows == 0:
+        raise ValueError(f"A {layout.name} card does not fit on a {page} page")
+    if per_page is not None and not 1 <= per_page <= columns * rows:
+        raise ValueError(f"per_page must be between 1 and {columns * rows} for {layout.name} cards on {page}")
+
+    # Centre the grid so the cutting margins are even
+    left = (width - columns * layout.width_mm - (columns - 1) * CARD_GAP_MM) / 2
+    top = (height - rows * layout.height_mm - (rows - 1) * CARD_GAP_MM) / 2
+    slots = [(left + column * (layout.width_mm + CARD_GAP_MM), top + row * (layout.height_mm + CARD_GAP_MM))
+             for row in range(rows) for column in range(columns)]
+    return width, height, slots[:per_page]
+
+
+def iter_rendered(cards, link_for, layout, cache, style=None, workers=1):
+    """Yield (card, bitmap) for cards in order, rendering cache misses in a process pool
+
+    link_for maps a username to the URL in its QR code and runs in the
+    calling process, as do all cache reads and writes.
+    """
+    pending = deque()
+
+    def jobs():
+        for chunk in chunked(cards, RENDER_CHUNK_SIZE):
+            versions = [card_version(card, link_for(card['username'])) for card in chunk]
+            cached = [cache.get(card['username'], layout.name, version)
+                      for card, version in zip(chunk, versions)]
+            pending.append((chunk, versions, cached))
+            yield [(card, version[1]) for card, version, bitmap in zip(chunk, versions, cached) if bitmap is None]
+
+    render = partial(_render_chunk, layout=layout.name, style=style or CardStyle())
+    for rendered in parallel_map(render, jobs(), workers):
+        chunk, versions, cached = pending.popleft()
+        rendered = iter(rendered)
+        for card, version, bitmap in zip(chunk, versions, cached):
+            if bitmap is None:
+                bitmap = next(rendered)
+                cache.set(card['username'], layout.name, version, bitmap)
+            yield card, bitmap
+
+
+def stream_sheets(cards, link_for, layout, cache, fmt='pdf', page='a4', per_page=None, style=None,
+                  workers=1, progress=None):
+    """Lay cards out N-up and yield the PDF (or ZIP of page PNGs) as byte chunks
+
+    progress, if given, is called with (cards placed, elapsed seconds).
+    """
+    page_width, page_height, slots = sheet_slots(layout, page, per_page)
+    buffer = StreamBuffer()
+    if fmt == 'pdf':
+        pdf = PDFWriter(buffer)
+        scale = POINTS_PER_INCH / MM_PER_INCH
+        card_width, card_height = layout.width_mm * scale, layout.height_mm * scale
+    else:
+        from PIL import Image
+        # PNGs are already deflated, so store them as-is
+        archive = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED)
+        pixels = DPI / MM_PER_INCH
+        page_size = (round(page_width * pixels), round(page_height * pixels))
+
+    def finish_page(placed, number):
+        if fmt == 'pdf':
+            pdf.add_sheet(page_width * scale, page_height * scale, [
+                (image_id, x * scale, (page_height - y) * scale - card_height, card_width, card_height)
+                for image_id, (x, y) in placed
+            ])
+        else:
+            sheet = Image.new('RGB', page_size, WHITE)
+            for bitmap, (x, y) in placed:
+                sheet.paste(decode_bitmap(bitmap), (round(x * pixels), round(y * pixels)))
+            archive.writestr(f'sheet-{number:04d}.png', encode_png(sheet))
+
+    started = time.perf_counter()
+    placed, count, pages = [], 0, 0
+    for card, bitmap in iter_rendered(cards, link_for, layout, cache, style, workers):
+        placed.append((_add_bitmap(pdf, bitmap) if fmt == 'pdf' else bitmap, slots[len(placed)]))
+        count += 1
+        if len(placed) == len(slots):
+            pages += 1
+            finish_page(placed, pages)
+            placed = []
+            if progress:
+                progress(count, time.perf_counter() - started)
+            yield buffer.drain()
+    if placed:
+        pages += 1
+        finish_page(placed, pages)
+        if progress:
+            progress(count, time.perf_counter() - started)
+    if fmt == 'pdf':
+        pdf.close()
+    else:
+        archive.close()
+    yield buffer.drain()
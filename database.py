@@ -0,0 +1,177 @@
+"""Connection pool tuning, pool statistics and read-replica routing
+
+The primary database serves every write. When a replica URL is configured it
+is registered as the ``replica`` bind, and views wrapped in ``read_replica``
+send their GET/HEAD queries there. A client that has just written keeps
+reading from the primary for a few seconds (a cookie marks it), so its own
+changes are never hidden by replication lag. Reads that fill a cache shared
+with other clients use primary_reads, so a lagging replica can never put
+data that an edit just invalidated back into the cache.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError
+
+PRE_PING_STRATEGIES = ('always', 'idle', 'never')
+REPLICA_BIND = 'replica'
+PRIMARY_COOKIE = 'db_primary_until'
+
+
+def engine_options(pool_size=None, max_overflow=None, pool_timeout=None, pool_recycle=300, pre_ping='idle'):
+    """Build SQLALCHEMY_ENGINE_OPTIONS, leaving unset pool settings at SQLAlchemy's defaults"""
+    if pre_ping not in PRE_PING_STRATEGIES:
+        raise ValueError(f"Unknown pre-ping strategy {pre_ping!r}, expected one of {', '.join(PRE_PING_STRATEGIES)}")
+    options = {
+        'pool_recycle': pool_recycle,
+        # The idle strategy pings from a checkout listener instead, see PoolStats
+        'pool_pre_ping': pre_ping == 'always',
+    }
+    for key, value in (('pool_size', pool_size), ('max_overflow', max_overflow), ('pool_timeout', pool_timeout)):
+        if value is not None:
+            options[key] = value
+    return options
+
+
+def pool_size_for_workers(max_connections, workers, reserve=0):
+    """Split a database connection budget evenly between worker processes"""
+    return max(1, (max_connections - reserve) // max(1, workers))
+
+
+class PoolStats:
+    """Counters for one engine's pool, plus the optional idle-connection ping
+
+    With the idle strategy a connection is only pinged when it sat unused in
+    the pool for at least ping_idle seconds; a failed ping discards it and
+    the pool hands out a fresh one.
+    """
+
+    def __init__(self, engine, pre_ping='idle', ping_idle=30):
+        self.engine = engine
+        self.ping_idle = ping_idle
+        self.connects = 0
+        self.checkouts = 0
+        self.pings = 0
+        self.ping_failures = 0
+        self.invalidations = 0
+        self._ping = pre_ping == 'idle'
+        self._lock = threading.Lock()
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, record):
+        with self._lock:
+            self.connects += 1
+        record.info['checked_in_at'] = time.monotonic()
+
+    def _on_checkout(self, dbapi_connection, record, proxy):
+        with self._lock:
+            self.checkouts += 1
+        if not self._ping or time.monotonic() - record.info.get('checked_in_at', 0) < self.ping_idle:
+            return
+        with self._lock:
+            self.pings += 1
+        try:
+            self.engine.dialect.do_ping(dbapi_connection)
+        except Exception:
+            with self._lock:
+                self.ping_failures += 1
+            # The pool discards the connection and retries the checkout
+            raise DisconnectionError()
+
+    def _on_checkin(self, dbapi_connection, record):
+        record.info['checked_in_at'] = time.monotonic()
+
+    def _on_invalidate(self, dbapi_connection, record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self):
+        """Return the current pool occupancy and counters as a dict"""
+        pool = self.engine.pool
+        stats = {
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'pings': self.pings,
+            'ping_failures': self.ping_failures,
+            'invalidations': self.invalidations,
+        }
+        # Only queue-style pools (not SQLite's in-memory pools) report occupancy
+        for key in ('size', 'checkedin', 'checkedout', 'overflow'):
+            method = getattr(pool, key, None)
+            if callable(method):
+                stats[key] = method()
+        return stats
+
+
+class RoutingSession(Session):
+    """Session that sends reads to the replica bind inside read_replica views"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if self._flushing or isinstance(clause, sa.UpdateBase):
+                g.db_wrote = True
+            elif g.get('db_read_replica'):
+                engine = self._db.engines.get(REPLICA_BIND)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(view):
+    """Route the GET/HEAD queries of a view to the read replica, when one is configured"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD') and not _recent_writer():
+            g.db_read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def primary_reads(active=True):
+    """Send the queries inside the block to the primary, even within a read_replica view"""
+    if not active or not has_request_context():
+        yield
+        return
+    previous = g.get('db_read_replica')
+    g.db_read_replica = False
+    try:
+        yield
+    finally:
+        g.db_read_replica = previous
+
+
+def _recent_writer():
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _pin_writers_to_primary(response):
+    if g.get('db_wrote') and current_app.config.get("DATABASE_REPLICA_URL"):
+        seconds = current_app.config["REPLICA_STICKY_SECONDS"]
+        response.set_cookie(PRIMARY_COOKIE, str(int(time.time() + seconds)), max_age=seconds,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+def init_app(app, db):
+    """Instrument every engine's pool and install replica stickiness; call after db.init_app"""
+    stats = {}
+    with app.app_context():
+        for key, engine in db.engines.items():
+            stats[key or 'primary'] = PoolStats(engine, app.config["DB_POOL_PRE_PING"],
+                                                app.config["DB_POOL_PING_IDLE_SECONDS"])
+    app.after_request(_pin_writers_to_primary)
+    app.extensions['pool_stats'] = stats
+    return stats
@@ -0,0 +1,257 @@
+"""Background jobs run by a small pool of worker threads in each process
+
+Handlers are registered by name and jobs carry JSON-serializable arguments,
+so the same job can live in memory or in a durable SQLite queue that
+survives restarts and is shared by every worker process on the host.
+Failed jobs are retried with exponential backoff; enqueue refuses new jobs
+once max_pending are waiting, so a burst degrades to doing the work inline
+later instead of growing the queue without bound.
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A named unit of work and its arguments"""
+
+    def __init__(self, name, args, attempts=0, id=None):
+        self.name = name
+        self.args = args
+        self.attempts = attempts
+        self.id = id
+
+
+class MemoryJobStore:
+    """Jobs held in this process only; lost on restart"""
+
+    durable = False
+
+    def __init__(self):
+        self._heap = []
+        self._ids = itertools.count()
+        self._ready = threading.Condition()
+
+    def put(self, job, run_at):
+        with self._ready:
+            heapq.heappush(self._heap, (run_at, next(self._ids), job))
+            self._ready.notify()
+
+    def claim(self, timeout):
+        """Return the next due job, waiting up to timeout seconds, or None"""
+        deadline = time.monotonic() + timeout
+        with self._ready:
+            while True:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                wait = min(remaining, self._heap[0][0] - now) if self._heap else remaining
+                self._ready.wait(wait)
+
+    def done(self, job):
+        pass
+
+    def depth(self):
+        with self._ready:
+            return len(self._heap)
+
+
+class SQLiteJobStore:
+    """Durable job queue in a local SQLite file
+
+    Claimed jobs are leased for lease seconds, so a job whose process died
+    mid-run is picked up again by another worker.
+    """
+
+    durable = True
+
+    def __init__(self, path, lease=300, poll_interval=0.5):
+        self.path = path
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._ready = threading.Condition()
+
+    def _connect(self):
+        # Opened (and the table created) on first use, so importing the app touches no files
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                args TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_at REAL NOT NULL,
+                locked_until REAL NOT NULL DEFAULT 0
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_run_at ON jobs (run_at)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def put(self, job, run_at):
+        conn = self._connect()
+        if job.id is None:
+            conn.execute("INSERT INTO jobs (name, args, run_at) VALUES (?, ?, ?)",
+                         (job.name, json.dumps(job.args), run_at))
+        else:
+            conn.execute("UPDATE jobs SET attempts = ?, run_at = ?, locked_until = 0 WHERE id = ?",
+                         (job.attempts, run_at, job.id))
+        with self._ready:
+            self._ready.notify()
+
+    def claim(self, timeout):
+        """Return the next due job, waiting up to timeout seconds, or None"""
+        deadline = time.monotonic() + timeout
+        conn = self._connect()
+        while True:
+            now = time.time()
+            # One statement, so two workers can never claim the same job
+            row = conn.execute(
+                "UPDATE jobs SET locked_until = ? WHERE id = ("
+                " SELECT id FROM jobs WHERE run_at <= ? AND locked_until <= ? ORDER BY run_at LIMIT 1"
+                ") RETURNING id, name, args, attempts",
+                (now + self.lease, now, now)).fetchone()
+            if row is not None:
+                return Job(row[1], json.loads(row[2]), row[3], row[0])
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # Woken early by a put from this process; other processes are polled
+            with self._ready:
+                self._ready.wait(min(remaining, self.poll_interval))
+
+    def done(self, job):
+        self._connect().execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def depth(self):
+        return self._connect().execute("SELECT count(*) FROM jobs").fetchone()[0]
+
+
+class JobQueue:
+    """Run registered handlers on background threads with retry and backpressure"""
+
+    def __init__(self, store, workers=2, max_pending=1000, max_attempts=3, retry_delay=1.0):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.handlers = {}
+        self.app = None
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.running = 0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, app):
+        """Run handlers inside app's context and start workers with the first request"""
+        self.app = app
+        # Durable queues may hold jobs from a previous run
+        app.before_request(self._ensure_workers)
+        app.extensions['jobs'] = self
+
+    def task(self, name):
+        """Register the decorated function as the handler for jobs called name"""
+        def decorator(func):
+            self.handlers[name] = func
+            return func
+        return decorator
+
+    def enqueue(self, name, *args):
+        """Queue a job, returning False if the queue is full"""
+        if name not in self.handlers:
+            raise KeyError(f"No handler registered for job {name!r}")
+        if self.store.depth() >= self.max_pending:
+            with self._lock:
+                self.rejected += 1
+            logger.warning(f"Job queue full ({self.max_pending} pending), dropped {name} job")
+            return False
+        self.store.put(Job(name, list(args)), time.time())
+        with self._lock:
+            self.enqueued += 1
+        self._ensure_workers()
+        return True
+
+    def depth(self):
+        return self.store.depth()
+
+    def _ensure_workers(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True).start()
+
+    def _work(self):
+        while True:
+            job = self.store.claim(timeout=5)
+            if job is not None:
+                self._run(job)
+
+    def _run(self, job):
+        handler = self.handlers.get(job.name)
+        with self._lock:
+            self.running += 1
+        try:
+            if handler is None:
+                raise KeyError(f"No handler registered for job {job.name!r}")
+            if self.app is not None:
+                with self.app.app_context():
+                    handler(*job.args)
+            else:
+                handler(*job.args)
+        except Exception:
+            job.attempts += 1
+            if handler is not None and job.attempts < self.max_attempts:
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                logger.warning(f"Job {job.name} failed (attempt {job.attempts}), retrying in {delay:.1f}s",
+                               exc_info=True)
+                self.store.put(job, time.time() + delay)
+                self._finish(retried=1)
+            else:
+                logger.exception(f"Job {job.name} failed after {job.attempts} attempts, giving up")
+                self.store.done(job)
+                self._finish(failed=1)
+        else:
+            self.store.done(job)
+            self._finish(completed=1)
+
+    def _finish(self, completed=0, failed=0, retried=0):
+        with self._lock:
+            self.running -= 1
+            self.completed += completed
+            self.failed += failed
+            self.retried += retried
+
+
+def create_job_queue(url=None, **options):
+    """Build the job queue for a store URL
+
+    No URL (or memory://) keeps jobs in process; sqlite:///path/to/jobs.db
+    uses the durable SQLite store.
+    """
+    if url and url.startswith('sqlite:///'):
+        return JobQueue(SQLiteJobStore(url[len('sqlite:///'):]), **options)
+    if url and url != 'memory://':
+        raise ValueError(f"Unsupported JOB_QUEUE_URL: {url}")
+    return JobQueue(MemoryJobStore(), **options)
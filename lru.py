@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU mapping with hit/miss counters
+
+    Base of the in-process caches (QR images, pages, cards, profiles); they
+    add their own get/set on top of lookup and store.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key, valid=None, count_miss=True):
+        """Return the value for key, or None
+
+        valid, if given, is called with the cached value; a value it rejects
+        is dropped and the lookup is a miss. With count_miss=False a miss is
+        left for the caller to count, e.g. after checking another tier.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                if valid is None or valid(value):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            if count_miss:
+                self.misses += 1
+            return None
+
+    def peek(self, key):
+        """Return the value for key without touching the LRU order or counters"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def store(self, key, value):
+        """Add or replace key, evicting the least recently used entries beyond max_entries"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,4 +1,7 @@
-from app import app
+from app import app, init_db
 
 if __name__ == '__main__':
+    # The development server sets up its own schema
+    with app.app_context():
+        init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
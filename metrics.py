@@ -0,0 +1,381 @@
+"""Request, database and cache instrumentation exposed in Prometheus text format
+
+Every metric lives in the memory of the process that recorded it. Under
+gunicorn or uvicorn with several workers, /metrics is answered by whichever
+worker receives the scrape, so each response covers that worker alone and
+successive scrapes can come from different workers. The process_info and
+process_start_time_seconds series identify the worker behind a response.
+For whole-service numbers, run one worker per scrape target or sum the
+per-worker series downstream.
+"""
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Default latency buckets in seconds, from sub-millisecond cache hits to slow renders
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class Histogram:
+    """Labelled histogram with fixed buckets, rendered in Prometheus text format"""
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for label_values, counts, total, count in sorted(series):
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class CounterMetric:
+    """Labelled monotonically increasing counter"""
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f'{self.name}{_format_labels(list(zip(self.label_names, label_values)))} {value}')
+        return lines
+
+
+class CacheCollector:
+    """Expose the hits/misses counters of a cache object"""
+
+    def __init__(self, name, cache):
+        self.name = name
+        self.cache = cache
+
+    def render(self):
+        lines = []
+        for result in ('hits', 'misses'):
+            metric = f'{self.name}_{result}_total'
+            lines.append(f'# HELP {metric} {self.name.replace("_", " ").capitalize()} {result}')
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {getattr(self.cache, result)}')
+        return lines
+
+
+class PoolCollector:
+    """Expose the occupancy gauges and counters of database.PoolStats objects by engine name"""
+
+    GAUGES = {
+        'size': 'Configured pool size',
+        'checkedin': 'Idle connections held by the pool',
+        'checkedout': 'Connections currently checked out',
+        'overflow': 'Connections open beyond the pool size',
+    }
+    COUNTERS = {
+        'connects': 'New database connections opened',
+        'checkouts': 'Connections checked out of the pool',
+        'pings': 'Liveness pings issued on checkout',
+        'ping_failures': 'Liveness pings that found a dead connection',
+        'invalidations': 'Connections discarded as invalid',
+    }
+
+    def __init__(self, pools):
+        self.pools = pools
+
+    def render(self):
+        snapshots = sorted((name, stats.snapshot()) for name, stats in self.pools.items())
+        lines = []
+        for kinds, metric_type, suffix in ((self.GAUGES, 'gauge', ''), (self.COUNTERS, 'counter', '_total')):
+            for key, help in kinds.items():
+                values = [(name, snapshot[key]) for name, snapshot in snapshots if key in snapshot]
+                if not values:
+                    continue
+                metric = f'db_pool_{key}{suffix}'
+                lines.append(f'# HELP {metric} {help}')
+                lines.append(f'# TYPE {metric} {metric_type}')
+                for name, value in values:
+                    lines.append(f'{metric}{_format_labels([("engine", name)])} {value}')
+        return lines
+
+
+class JobQueueCollector:
+    """Expose the depth and outcome counters of a jobs.JobQueue"""
+
+    COUNTERS = {
+        'enqueued': 'Background jobs queued',
+        'completed': 'Background jobs that succeeded',
+        'retried': 'Background job attempts that failed and were rescheduled',
+        'failed': 'Background jobs that failed on every attempt',
+        'rejected': 'Background jobs dropped because the queue was full',
+    }
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def render(self):
+        lines = [
+            '# HELP job_queue_depth Jobs waiting or running in the queue',
+            '# TYPE job_queue_depth gauge',
+            f'job_queue_depth {self.queue.depth()}',
+            '# HELP job_queue_running Jobs running in this process',
+            '# TYPE job_queue_running gauge',
+            f'job_queue_running {self.queue.running}',
+        ]
+        for key, help in self.COUNTERS.items():
+            lines.append(f'# HELP jobs_{key}_total {help}')
+            lines.append(f'# TYPE jobs_{key}_total counter')
+            lines.append(f'jobs_{key}_total {getattr(self.queue, key)}')
+        return lines
+
+
+class RateLimitCollector:
+    """Expose allowed and rejected request counts of a rate_limit.RateLimiter, by group"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def render(self):
+        lines = []
+        for key, help in (('allowed', 'Requests admitted by the rate limiter'),
+                          ('limited', 'Requests rejected with 429 by the rate limiter')):
+            counts = getattr(self.limiter, key)
+            lines.append(f'# HELP rate_limit_{key}_total {help}')
+            lines.append(f'# TYPE rate_limit_{key}_total counter')
+            for group in sorted(self.limiter.limits):
+                lines.append(f'rate_limit_{key}_total{_format_labels([("group", group)])} {counts[group]}')
+        return lines
+
+
+class SlowRequestProfiler:
+    """Sampling profiler that writes folded stacks for slow requests
+
+    A single background thread samples the stacks of threads currently
+    serving requests; when a request takes longer than threshold seconds its
+    samples are written in collapsed-stack format, which flamegraph.pl and
+    speedscope render as a flamegraph.
+    """
+
+    def __init__(self, output_dir, threshold, interval=0.005):
+        self.output_dir = output_dir
+        self.threshold = threshold
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        threading.Thread(target=self._run, name='slow-request-profiler', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                        frame = frame.f_back
+                    samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def stop(self, duration, label):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or duration < self.threshold:
+            return None
+        safe_label = ''.join(c if c.isalnum() else '_' for c in label).strip('_')
+        path = os.path.join(self.output_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{int(duration * 1000)}ms-{safe_label}.folded')
+        with open(path, 'w') as fp:
+            for stack, count in samples.items():
+                fp.write(f'{stack} {count}\n')
+        return path
+
+
+class ProcessCollector:
+    """Identify the worker process whose metrics a scrape returned"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started = time.time()
+
+    def render(self):
+        if self.pid != os.getpid():
+            # Forked after the app was imported (gunicorn --preload)
+            self.pid, self.started = os.getpid(), time.time()
+        return [
+            '# HELP process_info Worker process that answered this scrape; metrics cover this process only',
+            '# TYPE process_info gauge',
+            f'process_info{_format_labels([("pid", self.pid)])} 1',
+            '# HELP process_start_time_seconds Start time of the process since the Unix epoch',
+            '# TYPE process_start_time_seconds gauge',
+            f'process_start_time_seconds {self.started}',
+        ]
+
+
+class Metrics:
+    """Request, database and cache instrumentation for a Flask app, per process"""
+
+    def __init__(self):
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request latency by route',
+            ('method', 'route'))
+        self.requests = CounterMetric(
+            'http_requests_total', 'Requests by route and status code',
+            ('method', 'route', 'status'))
+        self.db_query_duration = Histogram(
+            'db_query_duration_seconds', 'Duration of individual SQL statements')
+        self.db_queries_per_request = Histogram(
+            'db_queries_per_request', 'SQL statements executed per request', ('route',),
+            buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+        self.phase_duration = Histogram(
+            'app_phase_duration_seconds', 'Time spent in instrumented phases of a request',
+            ('phase',))
+        self.collectors = [ProcessCollector()]
+        self.profiler = None
+
+    def init_app(self, app):
+        """Install request hooks, SQLAlchemy listeners and the optional profiler"""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        before_render_template.connect(self._before_render_template, app, weak=False)
+        template_rendered.connect(self._template_rendered, app, weak=False)
+
+        threshold_ms = app.config.get("PROFILE_SLOW_REQUESTS_MS")
+        if threshold_ms:
+            self.profiler = SlowRequestProfiler(app.config["PROFILE_OUTPUT_DIR"], threshold_ms / 1000)
+        app.extensions['metrics'] = self
+
+    def add_cache(self, name, cache):
+        """Report the hits and misses of a cache exposing those attributes"""
+        self.collectors.append(CacheCollector(name, cache))
+
+    def add_job_queue(self, queue):
+        """Report the depth and outcomes of a background job queue"""
+        self.collectors.append(JobQueueCollector(queue))
+
+    def add_rate_limiter(self, limiter):
+        """Report allowed and rejected requests per rate limit group"""
+        self.collectors.append(RateLimitCollector(limiter))
+
+    def add_pools(self, pools):
+        """Report connection pool statistics, given a dict of engine name to PoolStats"""
+        self.collectors.append(PoolCollector(pools))
+
+    @contextmanager
+    def timed(self, phase):
+        """Record the duration of a block under the given phase label"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_duration.observe(time.perf_counter() - started, phase)
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        if self.profiler:
+            self.profiler.start()
+
+    def _teardown_request(self, exc):
+        # Runs after the response is built, even when a view raised
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        status = getattr(g, 'metrics_status', 500 if exc else 200)
+        self.request_duration.observe(duration, request.method, route)
+        self.requests.inc(request.method, route, str(status))
+        self.db_queries_per_request.observe(g.pop('metrics_queries', 0), route)
+        if self.profiler:
+            self.profiler.stop(duration, f'{request.method} {route}')
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _before_render_template(self, sender, template, context, **extra):
+        g.metrics_render_started = time.perf_counter()
+
+    def _template_rendered(self, sender, template, context, **extra):
+        started = g.pop('metrics_render_started', None)
+        if started is not None:
+            self.phase_duration.observe(time.perf_counter() - started, f'template:{template.name}')
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return
+        self.db_query_duration.observe(time.perf_counter() - starts.pop())
+        if has_request_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in (self.request_duration, self.requests, self.db_query_duration,
+                       self.db_queries_per_request, self.phase_duration, *self.collectors):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
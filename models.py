@@ -1,11 +1,16 @@
+import secrets
+import string
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import DeclarativeBase
-from datetime import datetime
+from datetime import date, datetime
+from database import RoutingSession
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 
 class MedicalProfile(db.Model):
     __tablename__ = 'medical_profiles'
@@ -26,19 +31,159 @@ class MedicalProfile(db.Model):
     def __repr__(self):
         return f'<MedicalProfile {self.username}: {self.name}>'
     
+    # Columns exposed through to_dict() and the JSON API, in output order
+    SERIALIZED_FIELDS = (
+        'id', 'username', 'name', 'blood_type', 'allergy', 'condition',
+        'emergency_contact', 'last_checkup_date', 'last_checkup_details',
+        'doctor_notes', 'created_at', 'updated_at',
+    )
+
     def to_dict(self):
         """Convert model to dictionary for JSON serialization"""
-        return {
-            'id': self.id,
-            'username': self.username,
-            'name': self.name,
-            'blood_type': self.blood_type,
-            'allergy': self.allergy,
-            'condition': self.condition,
-            'emergency_contact': self.emergency_contact,
-            'last_checkup_date': self.last_checkup_date.isoformat() if self.last_checkup_date else None,
-            'last_checkup_details': self.last_checkup_details,
-            'doctor_notes': self.doctor_notes,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+        return self.serialize(self)
+
+    @staticmethod
+    def serialize(source, fields=SERIALIZED_FIELDS):
+        """Convert a profile or a selected-columns result row to a dictionary"""
+        data = {}
+        for field in fields:
+            value = getattr(source, field)
+            if isinstance(value, date):
+                value = value.isoformat()
+            data[field] = value
+        return data
+
+
+class CheckupRecord(db.Model):
+    """One checkup entry; rows are only ever appended
+
+    The newest entry is also copied onto the profile's last_checkup_* columns
+    so the profile page never has to read this table.
+    """
+    __tablename__ = 'checkup_history'
+    __table_args__ = (
+        db.Index('ix_checkup_history_profile_date', 'profile_id', 'checkup_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    profile_id = db.Column(db.Integer, db.ForeignKey('medical_profiles.id', ondelete='CASCADE'), nullable=False)
+    checkup_date = db.Column(db.Date, nullable=False)
+    details = db.Column(db.Text, nullable=True)
+    doctor_notes = db.Column(db.Text, nullable=True)
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # Columns returned by the history API, in output order
+    SERIALIZED_FIELDS = ('id', 'checkup_date', 'details', 'doctor_notes', 'recorded_at')
+
+    def __repr__(self):
+        return f'<CheckupRecord {self.profile_id} {self.checkup_date}>'
+
+
+def record_checkup(profile, checkup_date, details, doctor_notes=None):
+    """Append a checkup entry and refresh the profile's latest-checkup snapshot
+
+    A checkup without a date is recorded as today's. A backdated entry that is
+    older than the snapshot goes into the history only. The caller commits.
+    """
+    entry = CheckupRecord(profile_id=profile.id, checkup_date=checkup_date or datetime.utcnow().date(),
+                          details=details, doctor_notes=doctor_notes or None)
+    db.session.add(entry)
+    if profile.last_checkup_date is None or entry.checkup_date >= profile.last_checkup_date:
+        profile.last_checkup_date = entry.checkup_date
+        profile.last_checkup_details = details
+        if doctor_notes:
+            profile.doctor_notes = doctor_notes
+    return entry
+
+
+def seed_checkup_history(usernames=None):
+    """Create a first history entry from the snapshot of profiles that have none
+
+    Covers profiles created with checkup data (signup, bulk import) and rows
+    that predate the history table. Limited to usernames when given; the
+    caller commits.
+    """
+    has_checkup = or_(
+        MedicalProfile.last_checkup_date.isnot(None),
+        func.coalesce(MedicalProfile.last_checkup_details, '') != '',
+        func.coalesce(MedicalProfile.doctor_notes, '') != '',
+    )
+    has_history = select(CheckupRecord.id).where(CheckupRecord.profile_id == MedicalProfile.id).exists()
+    source = select(
+        MedicalProfile.id,
+        func.coalesce(MedicalProfile.last_checkup_date, func.date(MedicalProfile.updated_at), func.current_date(),
+                      type_=db.Date),
+        MedicalProfile.last_checkup_details,
+        MedicalProfile.doctor_notes,
+        func.coalesce(MedicalProfile.updated_at, func.current_timestamp(), type_=db.DateTime),
+    ).where(has_checkup, ~has_history)
+    if usernames is not None:
+        source = source.where(MedicalProfile.username.in_(usernames))
+    return db.session.execute(insert(CheckupRecord).from_select(
+        ['profile_id', 'checkup_date', 'details', 'doctor_notes', 'recorded_at'], source)).rowcount
+
+
+def parse_checkup_date(value):
+    """Parse a YYYY-MM-DD checkup date, returning None when empty or invalid"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def profile_fields_from_form(form):
+    """Normalize submitted profile data into MedicalProfile column values
+
+    Shared by the signup form and the bulk importer so both store the same
+    thing for the same input.
+    """
+    username = (form.get('username') or '').strip().lower()
+    if not username:
+        username = f"profile_{random_slug(8)}"
+    return {
+        'username': username,
+        'name': (form.get('name') or '').strip() or "Anonymous User",
+        'blood_type': form.get('blood_type') or '',
+        'allergy': (form.get('allergy') or '').strip(),
+        'condition': (form.get('condition') or '').strip(),
+        'emergency_contact': (form.get('emergency_contact') or '').strip(),
+        'last_checkup_date': parse_checkup_date(form.get('last_checkup_date') or ''),
+        'last_checkup_details': (form.get('last_checkup_details') or '').strip(),
+    }
+
+
+USERNAME_SLUG_ALPHABET = string.ascii_lowercase + string.digits
+
+
+def random_slug(length=6):
+    """Return a short random lowercase slug for generated usernames"""
+    return ''.join(secrets.choice(USERNAME_SLUG_ALPHABET) for _ in range(length))
+
+
+def save_with_unique_username(profile, max_attempts=5):
+    """Insert a new profile, re-suffixing its username until it is unique
+
+    Each attempt is a single INSERT and the unique index on username decides
+    collisions, so there is no check-then-insert race between workers. Any
+    checkup data the profile was created with becomes its first history
+    entry in the same transaction. Returns the username that was stored.
+    """
+    max_length = MedicalProfile.username.type.length
+    base = profile.username[:max_length]
+    profile.username = base
+    for attempt in range(max_attempts):
+        db.session.add(profile)
+        try:
+            if profile.last_checkup_date or profile.last_checkup_details or profile.doctor_notes:
+                db.session.flush()
+                seed_checkup_history([profile.username])
+            db.session.commit()
+            return profile.username
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == max_attempts - 1:
+                raise
+            suffix = random_slug()
+            profile.username = f"{base[:max_length - len(suffix) - 1]}_{suffix}"
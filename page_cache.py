@@ -0,0 +1,52 @@
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+from lru import LRUCache
+
+
+class CachedPage:
+    """Rendered HTML body with precompressed variants and its ETag"""
+
+    __slots__ = ('etag', 'variants')
+
+    def __init__(self, html, etag):
+        body = html.encode('utf-8')
+        self.etag = etag
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body)
+
+    def negotiate(self, accept_encodings):
+        """Return (body, content encoding) for the smallest acceptable variant"""
+        best = None
+        for encoding, body in self.variants.items():
+            if encoding != 'identity' and not accept_encodings[encoding]:
+                continue
+            if best is None or len(body) < len(best[0]):
+                best = (body, encoding)
+        return best
+
+
+class PageCache(LRUCache):
+    """Bounded, thread-safe LRU cache of rendered pages keyed on content version"""
+
+    def __init__(self, max_entries=2048):
+        super().__init__(max_entries)
+
+    @staticmethod
+    def make_etag(*parts):
+        """Derive a stable ETag from the values a page was rendered from"""
+        return hashlib.sha1('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def get_or_render(self, key, etag, render):
+        """Return the CachedPage for key, calling render() for the HTML on a miss"""
+        page = self.lookup(key)
+        if page is None:
+            page = CachedPage(render(), etag)
+            self.store(key, page)
+        return page
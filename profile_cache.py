@@ -0,0 +1,137 @@
+import json
+import logging
+import time
+
+from lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Set in the WSGI environ by the ASGI prefetch to (username, profile dict or
+# None if there is no such profile), so the view does not query again
+PROFILE_PREFETCH_ENVIRON = 'profile_cache.prefetched'
+
+
+class MemoryProfileCache(LRUCache):
+    """In-process LRU cache of profile dicts with a time-to-live
+
+    An invalidation only reaches the process that made the write, so this
+    cache is only used when the app runs as a single worker process; see
+    create_profile_cache.
+    """
+
+    stores = True
+
+    def __init__(self, max_entries=4096, ttl=5):
+        super().__init__(max_entries)
+        self.ttl = ttl
+
+    def get(self, username):
+        """Return the cached profile dict for username, or None"""
+        entry = self.lookup(username, valid=lambda entry: entry[0] > time.monotonic())
+        return entry[1] if entry is not None else None
+
+    def set(self, username, data):
+        """Cache a profile dict for username"""
+        self.store(username, (time.monotonic() + self.ttl, data))
+
+    def __contains__(self, username):
+        # Presence check that leaves the hit/miss counters alone
+        entry = self.peek(username)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def delete(self, username):
+        """Invalidate the cached profile for username"""
+        self.discard(username)
+
+
+class NullProfileCache:
+    """Profile cache that stores nothing, so every read goes to the database"""
+
+    stores = False
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        self.misses += 1
+        return None
+
+    def set(self, username, data):
+        pass
+
+    def __contains__(self, username):
+        return False
+
+    def delete(self, username):
+        pass
+
+    def clear(self):
+        pass
+
+
+class RedisProfileCache:
+    """Profile cache shared between workers through a Redis-compatible client
+
+    Any client exposing get, set(ex=...) and delete works, so tests can pass
+    a local stand-in such as fakeredis instead of a real server.
+    """
+
+    stores = True
+
+    def __init__(self, client, ttl=300, prefix='profile:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        """Return the cached profile dict for username, or None"""
+        raw = self.client.get(self.prefix + username)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, username, data):
+        """Cache a profile dict for username"""
+        self.client.set(self.prefix + username, json.dumps(data), ex=self.ttl)
+
+    def __contains__(self, username):
+        # Presence check that leaves the hit/miss counters alone
+        return bool(self.client.exists(self.prefix + username))
+
+    def delete(self, username):
+        """Invalidate the cached profile for username"""
+        self.client.delete(self.prefix + username)
+
+    def clear(self):
+        """Drop all cached profiles"""
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_profile_cache(url=None, ttl=None, max_entries=4096, workers=1):
+    """Build the profile cache for a backend URL
+
+    No URL gives the in-process cache; redis:// and rediss:// URLs use the
+    optional redis package. With several worker processes an in-process
+    cache would keep serving a profile after another worker changed it, so
+    caching is turned off instead.
+    """
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("PROFILE_CACHE_URL points at Redis but the redis package is not installed")
+        return RedisProfileCache(redis.Redis.from_url(url), ttl=ttl if ttl is not None else 300)
+    if url and url != 'memory://':
+        raise ValueError(f"Unsupported PROFILE_CACHE_URL: {url}")
+    if workers > 1:
+        logger.warning(f"In-process profile cache disabled with {workers} workers; "
+                       f"set PROFILE_CACHE_URL=redis://... to cache profiles")
+        return NullProfileCache()
+    return MemoryProfileCache(max_entries=max_entries, ttl=ttl if ttl is not None else 5)
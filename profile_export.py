@@ -0,0 +1,91 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from models import db, MedicalProfile
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the standard library encoder
+    orjson = None
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def parse_updated_since(value):
+    """Parse an ISO 8601 timestamp into the naive UTC datetime stored in the DB
+
+    Raises ValueError for malformed input.
+    """
+    since = datetime.fromisoformat(value)
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+
+def iter_pages(updated_since=None, page_size=5000):
+    """Yield lists of selected-column rows in id order, one keyset page at a time
+
+    Each page is a separate bounded query (WHERE id > last id LIMIT n), so no
+    long-lived cursor or ORM objects are held regardless of table size.
+    """
+    columns = [getattr(MedicalProfile, field) for field in MedicalProfile.SERIALIZED_FIELDS]
+    after = 0
+    while True:
+        stmt = select(*columns).where(MedicalProfile.id > after)
+        if updated_since is not None:
+            stmt = stmt.where(MedicalProfile.updated_at >= updated_since)
+        rows = db.session.execute(stmt.order_by(MedicalProfile.id).limit(page_size)).all()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1].id
+
+
+def _encode_csv_page(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(MedicalProfile.SERIALIZED_FIELDS)
+    for row in rows:
+        writer.writerow(MedicalProfile.serialize(row).values())
+    return buffer.getvalue().encode('utf-8')
+
+
+def _encode_ndjson_page(rows):
+    if orjson is not None:
+        lines = [orjson.dumps(MedicalProfile.serialize(row)) for row in rows]
+    else:
+        lines = [json.dumps(MedicalProfile.serialize(row), separators=(',', ':')).encode('utf-8') for row in rows]
+    return b'\n'.join(lines) + b'\n'
+
+
+def stream_export(fmt='ndjson', updated_since=None, page_size=5000, progress=None):
+    """Yield the export as byte chunks, one chunk per page of rows
+
+    progress, if given, is called after each page with the number of rows
+    written so far and the newest updated_at seen, which callers can pass
+    back as updated_since for the next incremental sync.
+    """
+    count = 0
+    newest = None
+    if fmt == 'csv':
+        # Header goes out even when nothing matches
+        yield _encode_csv_page([], header=True)
+    for rows in iter_pages(updated_since, page_size):
+        if fmt == 'csv':
+            yield _encode_csv_page(rows)
+        else:
+            yield _encode_ndjson_page(rows)
+        count += len(rows)
+        page_newest = max((row.updated_at for row in rows if row.updated_at), default=None)
+        if page_newest and (newest is None or page_newest > newest):
+            newest = page_newest
+        if progress:
+            progress(count, newest)
@@ -0,0 +1,183 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, MedicalProfile, profile_fields_from_form, random_slug, seed_checkup_history
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# Per-row errors kept for the summary; later ones are only counted
+MAX_REPORTED_ERRORS = 1000
+
+# String columns whose length the database would enforce
+_LENGTH_LIMITS = {
+    column.name: column.type.length
+    for column in MedicalProfile.__table__.columns
+    if getattr(column.type, 'length', None)
+}
+
+
+class ImportResult:
+    """Running totals, reported errors and renamed usernames for an import"""
+
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.renamed = []
+
+    def add_error(self, row, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'error': message})
+
+    def add_rename(self, row, username, imported_as):
+        # Every rename is kept: the old username is what existing QR codes point at
+        self.renamed.append({'row': row, 'username': username, 'imported_as': imported_as})
+
+    def to_dict(self):
+        return {'created': self.created, 'failed': self.failed, 'errors': self.errors, 'renamed': self.renamed}
+
+
+def guess_format(filename):
+    """Pick the import format from a file name, defaulting to CSV"""
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+def iter_records(stream, fmt):
+    """Yield (row number, record dict or error message) from a binary stream
+
+    Input is decoded and parsed incrementally, one line at a time. Only LF
+    or CRLF ends a row, so free text containing other Unicode line breaks
+    (U+2028, NEL, form feed) stays in its field.
+    """
+    # The csv module handles line endings itself and needs newline=''
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else '\n')
+    try:
+        yield from _parse_records(text, fmt)
+    finally:
+        # Leave the caller's stream open
+        text.detach()
+
+
+def _parse_records(text, fmt):
+    if fmt == 'csv':
+        # Row numbers count the header as row 1, matching spreadsheet tools
+        for row, record in enumerate(csv.DictReader(text), start=2):
+            yield row, record
+        return
+
+    for row, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row, f"invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield row, "expected a JSON object"
+            continue
+        yield row, record
+
+
+def normalize_record(record):
+    """Turn an import record into column values, or raise ValueError"""
+    record = {key: str(value) for key, value in record.items() if key and value is not None}
+    if not (record.get('name') or '').strip():
+        raise ValueError("name is required")
+    raw_date = (record.get('last_checkup_date') or '').strip()
+
+    fields = profile_fields_from_form(record)
+    fields['doctor_notes'] = (record.get('doctor_notes') or '').strip() or None
+
+    if raw_date and fields['last_checkup_date'] is None:
+        raise ValueError(f"invalid last_checkup_date {raw_date!r}, expected YYYY-MM-DD")
+    for column, limit in _LENGTH_LIMITS.items():
+        if fields.get(column) and len(fields[column]) > limit:
+            raise ValueError(f"{column} is longer than {limit} characters")
+    return fields
+
+
+def _dedupe_usernames(batch):
+    """Suffix usernames that already exist or repeat within the batch
+
+    Returns {row: original username} for the rows that were renamed.
+    """
+    usernames = [fields['username'] for _, fields in batch]
+    taken = set(db.session.execute(
+        select(MedicalProfile.username).where(MedicalProfile.username.in_(usernames))
+    ).scalars())
+    limit = _LENGTH_LIMITS['username']
+    renamed = {}
+    for row, fields in batch:
+        username = fields['username']
+        while username in taken:
+            suffix = random_slug()
+            username = f"{fields['username'][:limit - len(suffix) - 1]}_{suffix}"
+        if username != fields['username']:
+            renamed[row] = fields['username']
+        fields['username'] = username
+        taken.add(username)
+    return renamed
+
+
+def _insert_batch(batch, result):
+    """Insert a batch with one executemany, falling back to row by row"""
+    renamed = _dedupe_usernames(batch)
+    try:
+        db.session.execute(insert(MedicalProfile), [fields for _, fields in batch])
+        seed_checkup_history([fields['username'] for _, fields in batch])
+        db.session.commit()
+        result.created += len(batch)
+        for row, fields in batch:
+            if row in renamed:
+                result.add_rename(row, renamed[row], fields['username'])
+        return
+    except SQLAlchemyError:
+        db.session.rollback()
+
+    # Something in the batch was rejected; isolate it with one savepoint per row
+    for row, fields in batch:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(MedicalProfile), [fields])
+            result.created += 1
+            if row in renamed:
+                result.add_rename(row, renamed[row], fields['username'])
+        except SQLAlchemyError as e:
+            result.add_error(row, str(getattr(e, 'orig', e)).splitlines()[0])
+    seed_checkup_history([fields['username'] for _, fields in batch])
+    db.session.commit()
+
+
+def import_profiles(stream, fmt='csv', chunk_size=1000, progress=None):
+    """Stream records from a CSV or NDJSON file into medical_profiles
+
+    Rows are validated one at a time and inserted in chunks of chunk_size;
+    bad rows are reported in the result instead of aborting the import.
+    progress, if given, is called with the ImportResult after every chunk.
+    """
+    result = ImportResult()
+    records = iter_records(stream, fmt)
+    while chunk := list(islice(records, chunk_size)):
+        batch = []
+        for row, record in chunk:
+            if isinstance(record, str):
+                result.add_error(row, record)
+                continue
+            try:
+                batch.append((row, normalize_record(record)))
+            except ValueError as e:
+                result.add_error(row, str(e))
+        if batch:
+            _insert_batch(batch, result)
+        if progress:
+            progress(result)
+    return result
@@ -0,0 +1,102 @@
+"""Indexed search over profile names, allergies and conditions
+
+Postgres gets a GIN index on a weighted tsvector of the three columns (A for
+name, B for allergy, C for condition), so one index serves both the
+all-fields search and the single-field search through tsquery weight labels.
+SQLite gets an external-content FTS5 table kept in sync by triggers. Both are
+created by `flask --app app init-db`; other databases fall back to an
+unindexed ILIKE scan.
+
+Every term is a prefix match and all terms must match. Results come in id
+order so pages can be fetched with the same keyset `after` cursor as the
+profile listing.
+"""
+import re
+
+from sqlalchemy import and_, column, func, literal_column, or_, table
+
+from models import MedicalProfile
+
+SEARCH_FIELDS = ('name', 'allergy', 'condition')
+MAX_SEARCH_TERMS = 8
+
+_FIELD_WEIGHTS = {'name': 'A', 'allergy': 'B', 'condition': 'C'}
+
+# The query must repeat this expression exactly for Postgres to use the index
+_PG_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(allergy, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(condition, '')), 'C')"
+)
+_PG_INDEX = f"CREATE INDEX IF NOT EXISTS ix_medical_profiles_search ON medical_profiles USING gin (({_PG_DOCUMENT}))"
+
+_FTS_TABLE = 'medical_profiles_fts'
+_SQLITE_DDL = (
+    f"CREATE VIRTUAL TABLE {_FTS_TABLE} USING fts5(name, allergy, condition, content='medical_profiles', "
+    "content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"""CREATE TRIGGER {_FTS_TABLE}_ai AFTER INSERT ON medical_profiles BEGIN
+        INSERT INTO {_FTS_TABLE}(rowid, name, allergy, condition) VALUES (new.id, new.name, new.allergy, new.condition);
+    END""",
+    f"""CREATE TRIGGER {_FTS_TABLE}_ad AFTER DELETE ON medical_profiles BEGIN
+        INSERT INTO {_FTS_TABLE}({_FTS_TABLE}, rowid, name, allergy, condition)
+            VALUES ('delete', old.id, old.name, old.allergy, old.condition);
+    END""",
+    f"""CREATE TRIGGER {_FTS_TABLE}_au AFTER UPDATE OF name, allergy, condition ON medical_profiles BEGIN
+        INSERT INTO {_FTS_TABLE}({_FTS_TABLE}, rowid, name, allergy, condition)
+            VALUES ('delete', old.id, old.name, old.allergy, old.condition);
+        INSERT INTO {_FTS_TABLE}(rowid, name, allergy, condition) VALUES (new.id, new.name, new.allergy, new.condition);
+    END""",
+    # Index the rows that existed before the FTS table
+    f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}) VALUES ('rebuild')",
+)
+_fts = table(_FTS_TABLE, column('rowid'), column(_FTS_TABLE))
+
+
+def search_terms(query):
+    """Split a search query into lowercase word terms, at most MAX_SEARCH_TERMS"""
+    return re.findall(r'[^\W_]+', query.lower())[:MAX_SEARCH_TERMS]
+
+
+def install_search_index(connection):
+    """Create the search index for the connection's database if it is missing
+
+    Returns False for databases without a supported full-text index.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.exec_driver_sql(_PG_INDEX)
+        return True
+    if dialect == 'sqlite':
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (_FTS_TABLE,)).first()
+        if not exists:
+            for statement in _SQLITE_DDL:
+                connection.exec_driver_sql(statement)
+        return True
+    return False
+
+
+def search_statement(stmt, dialect, terms, field=None, after=0, limit=100):
+    """Restrict a select over MedicalProfile columns to profiles matching every term
+
+    field limits matching to one of SEARCH_FIELDS; results are ordered by id
+    and start after the given id.
+    """
+    if dialect == 'postgresql':
+        weight = _FIELD_WEIGHTS[field] if field else ''
+        query = ' & '.join(f'{term}:*{weight}' for term in terms)
+        document = literal_column(f'({_PG_DOCUMENT})')
+        stmt = stmt.where(document.op('@@')(func.to_tsquery(literal_column("'simple'"), query)))
+    elif dialect == 'sqlite':
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        if field:
+            match = f'{{{field}}} : ({match})'
+        # Drive the query from the FTS index, which yields matches in rowid order
+        return (stmt.join_from(_fts, MedicalProfile.__table__, _fts.c.rowid == MedicalProfile.id)
+                .where(_fts.c[_FTS_TABLE].op('MATCH')(match), _fts.c.rowid > after)
+                .order_by(_fts.c.rowid)
+                .limit(limit))
+    else:
+        columns = [getattr(MedicalProfile, name) for name in ([field] if field else SEARCH_FIELDS)]
+        stmt = stmt.where(and_(*(or_(*(c.ilike(f'%{term}%') for c in columns)) for term in terms)))
+    return stmt.where(MedicalProfile.id > after).order_by(MedicalProfile.id).limit(limit)
@@ -0,0 +1,242 @@
+import os
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+from sqlalchemy import select
+
+from models import db, MedicalProfile
+from qr_cache import make_qr, render_qr, DEFAULT_BOX_SIZE
+
+# Archive formats produced by a batch run and their mimetypes
+BATCH_FORMATS = {
+    'zip': 'application/zip',
+    'pdf': 'application/pdf',
+}
+
+# Number of codes handed to a worker process at a time
+RENDER_CHUNK_SIZE = 64
+
+
+def iter_usernames(usernames=None, chunk_size=1000):
+    """Yield profile usernames in id order, reading the table in chunks
+
+    With no usernames every profile is streamed with yield_per; otherwise
+    only the given usernames that exist are returned, one IN query per chunk.
+    """
+    if usernames is None:
+        stmt = (select(MedicalProfile.username)
+                .order_by(MedicalProfile.id)
+                .execution_options(yield_per=chunk_size))
+        yield from db.session.execute(stmt).scalars()
+        return
+
+    usernames = iter(usernames)
+    while chunk := list(islice(usernames, chunk_size)):
+        stmt = (select(MedicalProfile.username)
+                .where(MedicalProfile.username.in_(chunk))
+                .order_by(MedicalProfile.id))
+        yield from db.session.execute(stmt).scalars()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _render_chunk(jobs, fmt, box_size):
+    """Render a chunk of (username, link) jobs inside a worker process"""
+    results = []
+    for username, link in jobs:
+        if fmt == 'pdf':
+            img = make_qr(link, box_size).make_image(fill_color="black", back_color="white")
+            bitmap = img.get_image()
+            payload = (bitmap.width, bitmap.height, zlib.compress(bitmap.tobytes()))
+        else:
+            payload = render_qr(link, 'png', box_size)
+        results.append((username, payload))
+    return results
+
+
+def parallel_map(func, chunks, workers):
+    """Map func over chunks in a process pool, yielding results in order
+
+    Only a couple of chunks per worker are in flight at once, so the input
+    iterator (and the DB cursor behind it) is consumed as results drain.
+    """
+    if workers <= 1:
+        yield from map(func, chunks)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(func, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class StreamBuffer:
+    """Write-only file object whose contents are drained as response chunks"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class PDFWriter:
+    """Minimal streaming PDF writer producing one captioned QR code per page"""
+
+    MARGIN = 36
+    CAPTION_HEIGHT = 24
+
+    # Object numbers reserved up front; pages and images are numbered from 4
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    FONT_ID = 3
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._offsets = {}
+        self._page_ids = []
+        self._next_id = 4
+        self.fp.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._write_object(self.FONT_ID, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    def _write_object(self, object_id, body, stream=None):
+        self._offsets[object_id] = self.fp.tell()
+        self.fp.write(f'{object_id} 0 obj\n'.encode())
+        self.fp.write(body)
+        if stream is not None:
+            self.fp.write(b'\nstream\n')
+            self.fp.write(stream)
+            self.fp.write(b'\nendstream')
+        self.fp.write(b'\nendobj\n')
+
+    def _allocate(self, count):
+        ids = range(self._next_id, self._next_id + count)
+        self._next_id += count
+        return ids
+
+    def add_image(self, width, height, data, colorspace='DeviceGray', bits=1, decode_parms=None):
+        """Write a zlib-compressed image once and return its object id for placing on pages"""
+        (image_id,) = self._allocate(1)
+        parms = f'/DecodeParms {decode_parms} ' if decode_parms else ''
+        self._write_object(image_id, (
+            f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+            f'/ColorSpace /{colorspace} /BitsPerComponent {bits} /Filter /FlateDecode {parms}'
+            f'/Length {len(data)} >>'
+        ).encode(), data)
+        return image_id
+
+    def add_sheet(self, page_width, page_height, placements):
+        """Add a page placing images given as (image id, x, y, width, height) in points"""
+        content_id, page_id = self._allocate(2)
+        names = {image_id: f'Im{i}' for i, image_id in enumerate(dict.fromkeys(p[0] for p in placements))}
+        content = '\n'.join(f'q {w:.2f} 0 0 {h:.2f} {x:.2f} {y:.2f} cm /{names[image_id]} Do Q'
+                             for image_id, x, y, w, h in placements).encode()
+        self._write_object(content_id, f'<< /Length {len(content)} >>'.encode(), content)
+
+        xobjects = ' '.join(f'/{name} {image_id} 0 R' for image_id, name in names.items())
+        self._write_object(page_id, (
+            f'<< /Type /Page /Parent {self.PAGES_ID} 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] '
+            f'/Resources << /XObject << {xobjects} >> >> /Contents {content_id} 0 R >>'
+        ).encode())
+        self._page_ids.append(page_id)
+
+    def add_page(self, width, height, bitmap, caption=''):
+        """Add a page holding a 1-bit, zlib-compressed bitmap and a caption"""
+        image_id = self.add_image(width, height, bitmap)
+        content_id, page_id = self._allocate(2)
+
+        text = caption.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+        content = (
+            f'q {width} 0 0 {height} {self.MARGIN} {self.MARGIN + self.CAPTION_HEIGHT} cm /Im0 Do Q\n'
+            f'BT /F1 12 Tf {self.MARGIN} {self.MARGIN} Td ({text}) Tj ET'
+        ).encode('latin-1', errors='replace')
+        self._write_object(content_id, f'<< /Length {len(content)} >>'.encode(), content)
+
+        page_width = width + 2 * self.MARGIN
+        page_height = height + 2 * self.MARGIN + self.CAPTION_HEIGHT
+        self._write_object(page_id, (
+            f'<< /Type /Page /Parent {self.PAGES_ID} 0 R /MediaBox [0 0 {page_width} {page_height}] '
+            f'/Resources << /XObject << /Im0 {image_id} 0 R >> /Font << /F1 {self.FONT_ID} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>'
+        ).encode())
+        self._page_ids.append(page_id)
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer"""
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self._page_ids)
+        self._write_object(self.PAGES_ID,
+                           f'<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>'.encode())
+        self._write_object(self.CATALOG_ID, f'<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>'.encode())
+
+        xref_offset = self.fp.tell()
+        size = self._next_id
+        lines = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+        for object_id in range(1, size):
+            lines.append(f'{self._offsets[object_id]:010d} 00000 n \n')
+        lines.append(f'trailer\n<< /Size {size} /Root {self.CATALOG_ID} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n')
+        self.fp.write(''.join(lines).encode())
+
+
+def stream_batch(usernames, link_for, fmt='zip', box_size=DEFAULT_BOX_SIZE,
+                 workers=None, progress=None):
+    """Render QR codes for usernames and yield the archive as byte chunks
+
+    link_for maps a username to the URL encoded in its code and runs in the
+    calling process; encoding and rasterising happen in a process pool.
+    progress, if given, is called with (rendered count, elapsed seconds).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    buffer = StreamBuffer()
+    if fmt == 'pdf':
+        archive = PDFWriter(buffer)
+    else:
+        # PNGs are already deflated, so store them as-is
+        archive = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED)
+
+    jobs = ((username, link_for(username)) for username in usernames)
+    render = partial(_render_chunk, fmt=fmt, box_size=box_size)
+
+    started = time.perf_counter()
+    count = 0
+    for results in parallel_map(render, chunked(jobs, RENDER_CHUNK_SIZE), workers):
+        for username, payload in results:
+            if fmt == 'pdf':
+                archive.add_page(*payload, caption=username)
+            else:
+                archive.writestr(f"{username.replace('/', '_')}.png", payload)
+        count += len(results)
+        if progress:
+            progress(count, time.perf_counter() - started)
+        yield buffer.drain()
+
+    archive.close()
+    yield buffer.drain()
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import tempfile
+from io import BytesIO
+
+from lru import LRUCache
+
+# Same values as qrcode.constants; qrcode (and Pillow with it) is only
+# imported once a code is actually rendered, which keeps worker boot fast
+ERROR_CORRECT_L = 1
+ERROR_CORRECT_M = 0
+ERROR_CORRECT_Q = 3
+ERROR_CORRECT_H = 2
+
+# Output formats served by the QR endpoint and their mimetypes
+QR_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+DEFAULT_BOX_SIZE = 10
+MAX_BOX_SIZE = 20
+
+logger = logging.getLogger(__name__)
+
+
+def make_qr(data, box_size=DEFAULT_BOX_SIZE, error_correction=ERROR_CORRECT_M):
+    """Build a QRCode object for data at the smallest version that fits"""
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def render_qr(data, fmt='png', box_size=DEFAULT_BOX_SIZE, error_correction=ERROR_CORRECT_M):
+    """Encode data as a QR code and return the rendered image bytes"""
+    qr = make_qr(data, box_size, error_correction)
+    buffer = BytesIO()
+    if fmt == 'svg':
+        # Single <path> element, far smaller than one <rect> per module
+        import qrcode.image.svg
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        img.save(buffer)
+    else:
+        # Black on white renders as a 1-bit image, so the PNG stays tiny
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class QRCache(LRUCache):
+    """Bounded, thread-safe LRU cache of rendered QR code images
+
+    With a directory, prerender() also keeps images there as files named by a
+    hash of their data and options, and get(shared=True) looks there before
+    rendering, so every worker process on the host shares what a background
+    job rendered. Requests only ever read the directory, so clients cannot
+    fill the disk, and it holds at most max_files images (the oldest are
+    removed first). Only use it for data that may sit on disk: profile links,
+    never embedded medical data.
+    """
+
+    def __init__(self, max_entries=1024, directory=None, max_files=50000):
+        super().__init__(max_entries)
+        self.directory = directory
+        self.max_files = max_files
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, f'{digest}.{key[1]}')
+
+    def _read_shared(self, key):
+        try:
+            with open(self._path(key), 'rb') as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    def _write_shared(self, key, body):
+        # Write then rename, so readers never see a partial image
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(body)
+            os.replace(tmp, self._path(key))
+            self._evict_shared()
+        except OSError as e:
+            logger.warning(f"Could not write shared QR cache file: {e}")
+
+    def _evict_shared(self):
+        """Remove the oldest files beyond max_files"""
+        with os.scandir(self.directory) as entries:
+            files = [(entry.stat().st_mtime, entry.path) for entry in entries
+                     if entry.is_file() and not entry.name.endswith('.tmp')]
+        if len(files) <= self.max_files:
+            return
+        files.sort()
+        for _, path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # another worker removed it first
+
+    def get(self, data, fmt='png', box_size=DEFAULT_BOX_SIZE, error_correction=ERROR_CORRECT_M, shared=False):
+        """Return (image bytes, etag) for data, rendering it on a miss
+
+        With shared=True a miss first looks for a pre-rendered file.
+        """
+        key = (data, fmt, box_size, error_correction)
+        entry = self.lookup(key, count_miss=False)
+        if entry is not None:
+            return entry
+
+        body = self._read_shared(key) if shared and self.directory else None
+        with self._lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if body is None:
+            # Render outside the lock so concurrent misses don't serialize
+            body = render_qr(data, fmt, box_size, error_correction)
+        entry = (body, hashlib.sha1(body).hexdigest())
+        self.store(key, entry)
+        return entry
+
+    def prerender(self, data, fmt='png', box_size=DEFAULT_BOX_SIZE, error_correction=ERROR_CORRECT_M):
+        """Render data into the cache and, with a directory, the shared files"""
+        body, etag = self.get(data, fmt, box_size, error_correction, shared=True)
+        if self.directory:
+            self._write_shared((data, fmt, box_size, error_correction), body)
+        return body, etag
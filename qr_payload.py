@@ -0,0 +1,233 @@
+"""Signed offline payloads that embed critical profile data in a QR code
+
+A payload is the text ``MEP:`` followed by the Base45 (RFC 9285) encoding of:
+
+    byte     format version (2)
+    byte     flags (bit 0: body is raw-deflate compressed)
+    body     blood type index (1 byte, 0 = unknown), last update as days since
+             1970-01-01 (2 bytes, big endian), then name, allergies, conditions
+             and emergency contact as varint-length-prefixed UTF-8
+    64 bytes Ed25519 signature over everything before it
+
+Base45 keeps the text inside the QR alphanumeric character set, as the EU
+Digital COVID Certificate does. Payloads are signed with a private key that
+stays on the server; readers verify them offline with decode_payload and
+only the 32-byte public key, which cannot be used to sign new payloads.
+"""
+import hashlib
+import zlib
+from datetime import date, datetime
+from functools import lru_cache
+
+from qr_cache import ERROR_CORRECT_H, ERROR_CORRECT_L, ERROR_CORRECT_M, ERROR_CORRECT_Q
+
+PAYLOAD_PREFIX = 'MEP:'
+FORMAT_VERSION = 2
+FLAG_DEFLATED = 0x01
+SIGNATURE_SIZE = 64
+
+BLOOD_TYPES = ('', 'A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+
+# Text fields in payload order, with the most UTF-8 bytes embedded for each
+TEXT_FIELDS = (
+    ('name', 60),
+    ('allergy', 300),
+    ('condition', 300),
+    ('emergency_contact', 120),
+)
+
+# Tried from most to least robust; the smallest version wins, ties go to higher EC
+ERROR_CORRECTION_LEVELS = (ERROR_CORRECT_H, ERROR_CORRECT_Q, ERROR_CORRECT_M, ERROR_CORRECT_L)
+
+BASE45_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+_BASE45_VALUES = {char: value for value, char in enumerate(BASE45_ALPHABET)}
+
+_EPOCH = date(1970, 1, 1)
+
+
+class InvalidPayload(ValueError):
+    """Raised when a payload is malformed or its signature does not verify"""
+
+
+class PayloadTooLarge(ValueError):
+    """Raised when a payload does not fit in any QR code version"""
+
+
+def base45_encode(data):
+    chars = []
+    for i in range(0, len(data) - 1, 2):
+        n = data[i] * 256 + data[i + 1]
+        n, c = divmod(n, 45)
+        e, d = divmod(n, 45)
+        chars += (BASE45_ALPHABET[c], BASE45_ALPHABET[d], BASE45_ALPHABET[e])
+    if len(data) % 2:
+        d, c = divmod(data[-1], 45)
+        chars += (BASE45_ALPHABET[c], BASE45_ALPHABET[d])
+    return ''.join(chars)
+
+
+def base45_decode(text):
+    try:
+        values = [_BASE45_VALUES[char] for char in text]
+    except KeyError:
+        raise InvalidPayload("invalid Base45 character")
+    if len(values) % 3 == 1:
+        raise InvalidPayload("invalid Base45 length")
+    out = bytearray()
+    for i in range(0, len(values), 3):
+        group = values[i:i + 3]
+        if len(group) == 3:
+            n = group[0] + group[1] * 45 + group[2] * 45 * 45
+            if n > 0xFFFF:
+                raise InvalidPayload("invalid Base45 group")
+            out += bytes(divmod(n, 256))
+        else:
+            n = group[0] + group[1] * 45
+            if n > 0xFF:
+                raise InvalidPayload("invalid Base45 group")
+            out.append(n)
+    return bytes(out)
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        if pos >= len(data) or shift > 28:
+            raise InvalidPayload("truncated payload")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def signing_key(secret):
+    """Derive the raw 32-byte Ed25519 private key from a high-entropy secret string"""
+    return hashlib.sha256(secret.encode()).digest()
+
+
+@lru_cache(maxsize=8)
+def _private_key(key):
+    # cryptography is only imported once a payload is signed or verified,
+    # which keeps worker boot fast
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    return Ed25519PrivateKey.from_private_bytes(key)
+
+
+def verify_key(key):
+    """Return the raw 32-byte public key that readers verify payloads with"""
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+    return _private_key(key).public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+
+
+def _truncate_utf8(value, limit):
+    """Encode value as UTF-8, cut to at most limit bytes on a character boundary"""
+    return value.encode('utf-8')[:limit].decode('utf-8', errors='ignore').encode('utf-8')
+
+
+def encode_payload(profile, key):
+    """Pack a profile dict (as from MedicalProfile.to_dict()) into signed payload text"""
+    body = bytearray()
+    blood_type = profile.get('blood_type') or ''
+    body.append(BLOOD_TYPES.index(blood_type) if blood_type in BLOOD_TYPES else 0)
+
+    updated = profile.get('updated_at')
+    if isinstance(updated, str):
+        updated = datetime.fromisoformat(updated)
+    days = (updated.date() - _EPOCH).days if updated else 0
+    body += min(max(days, 0), 0xFFFF).to_bytes(2, 'big')
+
+    for field, limit in TEXT_FIELDS:
+        value = _truncate_utf8((profile.get(field) or '').strip(), limit)
+        _write_varint(body, len(value))
+        body += value
+
+    flags = 0
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    deflated = compressor.compress(bytes(body)) + compressor.flush()
+    if len(deflated) < len(body):
+        body, flags = deflated, FLAG_DEFLATED
+
+    message = bytes((FORMAT_VERSION, flags)) + bytes(body)
+    return PAYLOAD_PREFIX + base45_encode(message + _private_key(key).sign(message))
+
+
+def decode_payload(text, public_key):
+    """Verify and unpack payload text, returning a profile dict
+
+    public_key is the raw 32-byte key from verify_key(). Raises
+    InvalidPayload if the text is malformed or was not signed with the
+    matching private key.
+    """
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+
+    if not text.startswith(PAYLOAD_PREFIX):
+        raise InvalidPayload("not an embedded profile payload")
+    raw = base45_decode(text[len(PAYLOAD_PREFIX):])
+    if len(raw) < 2 + SIGNATURE_SIZE:
+        raise InvalidPayload("truncated payload")
+    message, signature = raw[:-SIGNATURE_SIZE], raw[-SIGNATURE_SIZE:]
+    try:
+        Ed25519PublicKey.from_public_bytes(public_key).verify(signature, message)
+    except InvalidSignature:
+        raise InvalidPayload("signature does not match")
+    if message[0] != FORMAT_VERSION:
+        raise InvalidPayload(f"unsupported payload version {message[0]}")
+
+    body = message[2:]
+    if message[1] & FLAG_DEFLATED:
+        try:
+            body = zlib.decompress(body, -15)
+        except zlib.error:
+            raise InvalidPayload("corrupt compressed body")
+    if len(body) < 3:
+        raise InvalidPayload("truncated payload")
+
+    profile = {
+        'blood_type': BLOOD_TYPES[body[0]] if body[0] < len(BLOOD_TYPES) else '',
+        'updated': None,
+    }
+    days = int.from_bytes(body[1:3], 'big')
+    if days:
+        profile['updated'] = date.fromordinal(_EPOCH.toordinal() + days).isoformat()
+    pos = 3
+    for field, _ in TEXT_FIELDS:
+        length, pos = _read_varint(body, pos)
+        if pos + length > len(body):
+            raise InvalidPayload("truncated payload")
+        profile[field] = body[pos:pos + length].decode('utf-8', errors='replace')
+        pos += length
+    return profile
+
+
+@lru_cache(maxsize=1024)
+def fit_payload(text):
+    """Return (error correction, version) for the smallest QR code holding text
+
+    Raises PayloadTooLarge if it does not fit in any QR version.
+    """
+    import qrcode
+    from qrcode.exceptions import DataOverflowError
+
+    best = None
+    for error_correction in ERROR_CORRECTION_LEVELS:
+        qr = qrcode.QRCode(error_correction=error_correction)
+        qr.add_data(text)
+        try:
+            version = qr.best_fit()
+        except DataOverflowError:
+            continue
+        if best is None or version < best[1]:
+            best = (error_correction, version)
+    if best is None:
+        raise PayloadTooLarge("payload does not fit in a QR code")
+    return best
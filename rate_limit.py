@@ -0,0 +1,291 @@
+"""Token-bucket rate limiting per client IP and route group
+
+Each route belongs to a named group with its own limit, and each client IP
+gets one bucket per group, so a flood of signups or API calls never uses up
+the budget for scanning profile pages. Scans get the most generous limit;
+scans of usernames that do not exist also draw from a small ``miss`` bucket,
+and a client that has emptied it is blocked from scanning until it refills,
+which makes enumerating profiles slow without affecting real scans.
+
+IPv6 clients are limited per /64 prefix, the block a single host or
+subscriber usually gets, so rotating through its addresses gains nothing.
+Networks listed in RATE_LIMIT_EXEMPT (hospital or ambulance networks) are
+never limited, and if the bucket store fails the request is let through.
+Buckets live in memory per process, or in a local SQLite file shared by all
+workers on the host.
+"""
+import ipaddress
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+
+from flask import abort, current_app, make_response, request
+from werkzeug.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# IPv6 clients share one bucket per prefix of this length
+IPV6_PREFIX = 64
+
+DEFAULT_LIMITS = {
+    'scan': '120/minute',   # profile pages and QR images
+    'miss': '30/minute',    # scans of unknown usernames
+    'create': '10/minute',  # signups
+    'edit': '30/minute',    # checkup updates
+    'api': '600/minute',    # JSON API
+    'print': '30/minute',   # single printable cards
+    'bulk': '10/hour',      # batch QR, import and export
+}
+
+
+class Rate:
+    """A bucket of limit tokens refilled evenly over period seconds"""
+
+    def __init__(self, limit, period):
+        if limit < 1 or period <= 0:
+            raise ValueError(f"Invalid rate {limit}/{period}s")
+        self.limit = limit
+        self.period = period
+        self.per_second = limit / period
+
+    @classmethod
+    def parse(cls, value):
+        """Parse a rate such as 120/minute or 5/second"""
+        try:
+            limit, period = value.strip().split('/')
+            return cls(int(limit), PERIODS[period.strip().lower()])
+        except (KeyError, ValueError):
+            raise ValueError(f"Invalid rate {value!r}, expected <count>/<{'|'.join(PERIODS)}>") from None
+
+
+def parse_limits(value=None, defaults=DEFAULT_LIMITS):
+    """Build the group to Rate mapping from defaults and a "group=rate,..." override string"""
+    limits = dict(defaults)
+    for item in (value or '').split(','):
+        if item.strip():
+            group, _, rate = item.partition('=')
+            limits[group.strip()] = rate
+    return {group: Rate.parse(rate) for group, rate in limits.items()}
+
+
+class MemoryBucketStore:
+    """Buckets held in this process; each gunicorn worker limits separately
+
+    At most max_keys buckets are kept, least recently used first out; a
+    dropped bucket comes back full.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, cost=1, required=None):
+        """Take cost tokens if at least required (default cost) are available
+
+        Returns 0 when the tokens were taken, otherwise the seconds until
+        enough will be.
+        """
+        required = cost if required is None else required
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (rate.limit, now))
+            tokens = min(rate.limit, tokens + (now - updated) * rate.per_second)
+            granted = tokens >= required
+            self._buckets[key] = (tokens - cost if granted else tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0 if granted else (required - tokens) / rate.per_second
+
+
+class SQLiteBucketStore:
+    """Buckets in a local SQLite file, shared by every worker process on the host"""
+
+    # One statement, so concurrent workers never both spend the same tokens
+    _TAKE = """
+        INSERT INTO rate_buckets (key, tokens, updated, granted) VALUES (:key, :limit - :cost, :now, 1)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = min(:limit, tokens + (:now - updated) * :per_second)
+                     - CASE WHEN min(:limit, tokens + (:now - updated) * :per_second) >= :required
+                            THEN :cost ELSE 0 END,
+            granted = min(:limit, tokens + (:now - updated) * :per_second) >= :required,
+            updated = :now
+        RETURNING tokens, granted
+    """
+
+    def __init__(self, path, prune_every=10000):
+        self.path = path
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._takes = 0
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                granted INTEGER NOT NULL
+            ) WITHOUT ROWID""")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Losing the last few bucket updates in a crash is harmless
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, rate, cost=1, required=None):
+        """Take cost tokens if at least required (default cost) are available
+
+        Returns 0 when the tokens were taken, otherwise the seconds until
+        enough will be.
+        """
+        required = cost if required is None else required
+        conn = self._connect()
+        now = time.time()
+        tokens, granted = conn.execute(self._TAKE, {
+            'key': key, 'limit': rate.limit, 'per_second': rate.per_second,
+            'cost': cost, 'required': required, 'now': now,
+        }).fetchone()
+        self._takes += 1
+        if self._takes % self.prune_every == 0:
+            # Buckets untouched for a day are full again, so dropping them changes nothing
+            conn.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - PERIODS['day'],))
+        return 0 if granted else (required - tokens) / rate.per_second
+
+
+class RateLimiter:
+    """Apply per-group token buckets to the requesting client's IP address"""
+
+    def __init__(self, store, limits, exempt=()):
+        self.store = store
+        self.limits = limits
+        self.exempt = [ipaddress.ip_network(network.strip(), strict=False) for network in exempt if network.strip()]
+        self.allowed = Counter()
+        self.limited = Counter()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.extensions['rate_limiter'] = self
+
+    def client_key(self, address):
+        """The bucket key for a client address, or None if it is exempt
+
+        IPv6 addresses are reduced to their /64 prefix (IPv4-mapped ones to
+        the IPv4 address); anything unparsable is used as given.
+        """
+        try:
+            ip = ipaddress.ip_address(address or '')
+        except ValueError:
+            return str(address)
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if any(ip in network for network in self.exempt):
+            return None
+        if ip.version == 6:
+            return str(ipaddress.ip_network(f'{ip}/{IPV6_PREFIX}', strict=False))
+        return str(ip)
+
+    def is_exempt(self, address):
+        return self.client_key(address) is None
+
+    def available(self, group, address):
+        """Whether address has a token left in group, without taking it or counting the request"""
+        rate = self.limits.get(group)
+        client = self.client_key(address)
+        if rate is None or client is None:
+            return True
+        try:
+            return not self.store.take(f'{group}:{client}', rate, cost=0, required=1)
+        except Exception:
+            return True
+
+    def hit(self, group, cost=1, required=None):
+        """Charge the current client against group; returns 0 or the seconds to wait"""
+        rate = self.limits.get(group)
+        client = self.client_key(request.remote_addr)
+        if rate is None or client is None:
+            return 0
+        try:
+            wait = self.store.take(f'{group}:{client}', rate, cost, required)
+        except Exception as e:
+            # Never turn away a scan because the limiter itself is broken
+            logger.warning(f"Rate limit store failed, allowing request: {e}")
+            return 0
+        with self._lock:
+            if wait:
+                self.limited[group] += 1
+            elif cost:
+                self.allowed[group] += 1
+        return wait
+
+
+def create_rate_limiter(url=None, limits=None, exempt=()):
+    """Build the rate limiter for a store URL
+
+    No URL (or memory://) keeps buckets per process; sqlite:///path/to/file.db
+    shares them between the workers on one host.
+    """
+    if url and url.startswith('sqlite:///'):
+        store = SQLiteBucketStore(url[len('sqlite:///'):])
+    elif url and url != 'memory://':
+        raise ValueError(f"Unsupported RATE_LIMIT_URL: {url}")
+    else:
+        store = MemoryBucketStore()
+    return RateLimiter(store, parse_limits(limits), exempt)
+
+
+def check_rate_limit(group, cost=1, required=None):
+    """Abort with 429 and Retry-After when the current client is over group's limit"""
+    limiter = current_app.extensions.get('rate_limiter')
+    if limiter is None:
+        return
+    wait = limiter.hit(group, cost, required)
+    if wait:
+        abort(429, retry_after=math.ceil(wait))
+
+
+def charge_rate_limit(group, cost=1):
+    """Charge the current client against group without refusing the request"""
+    limiter = current_app.extensions.get('rate_limiter')
+    if limiter is not None:
+        limiter.hit(group, cost)
+
+
+def rate_limit(group, methods=None, misses=None):
+    """Limit a view to group's rate per client, optionally only for some HTTP methods
+
+    With misses, 404 responses (returned or raised with abort) are also
+    charged to that group and the view is refused while the client has no
+    misses left.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if methods is not None and request.method not in methods:
+                return view(*args, **kwargs)
+            if misses:
+                check_rate_limit(misses, cost=0, required=1)
+            check_rate_limit(group)
+            if not misses:
+                return view(*args, **kwargs)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except NotFound:
+                charge_rate_limit(misses)
+                raise
+            if response.status_code == 404:
+                charge_rate_limit(misses)
+            return response
+        return wrapper
+    return decorator
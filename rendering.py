@@ -0,0 +1,97 @@
+"""Page rendering: templates compiled once, shared fragments and minified markup
+
+Template sources are minified as they are loaded (whitespace between tags is
+collapsed and HTML comments dropped), so the compiled templates emit compact
+HTML with no per-request post-processing and user data is never rewritten.
+Compiled code is kept in a Jinja bytecode cache on disk, so new worker
+processes skip the parse/compile step, and every page template is loaded
+when the app starts, so a missing or broken template fails the boot instead
+of the first request.
+
+Fragments under templates/fragments/ have no per-request data; they are
+rendered once at startup and exposed to templates as ``fragments``. Changes
+to them need a restart even with template auto-reload on.
+"""
+import re
+
+from jinja2 import BaseLoader, FileSystemBytecodeCache
+from markupsafe import Markup
+
+BLOOD_TYPES = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+FRAGMENTS_DIR = 'fragments/'
+
+# Whitespace is significant inside these, so they are left as written
+_PRESERVE = re.compile(r'<(pre|textarea|script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+_WHITESPACE = re.compile(r'\s+')
+_TAG_GAP = re.compile(r'>\s(?=<(?!a\b|button\b|img\b|span\b|strong\b|input\b))', re.IGNORECASE)
+# Between markup and a Jinja statement, e.g. "</div> {% endif %} <div>"
+_STATEMENT_GAP = re.compile(r'(?<=>)\s(?={%)|(?<=%})\s(?=<|{%)')
+_HELD = re.compile(r'<\0(\d+)>')
+
+
+def _collapse(markup):
+    markup = _WHITESPACE.sub(' ', _COMMENT.sub('', markup))
+    markup = _STATEMENT_GAP.sub('', markup)
+    # Keep one space before inline elements, where it separates them on the page
+    return _TAG_GAP.sub('>', markup)
+
+
+def minify_html(source):
+    """Collapse insignificant whitespace and drop comments from HTML or template source"""
+    preserved = []
+
+    def hold(match):
+        preserved.append(match.group(0))
+        return f'<\0{len(preserved) - 1}>'
+
+    markup = _collapse(_PRESERVE.sub(hold, source))
+    return _HELD.sub(lambda match: preserved[int(match.group(1))], markup).strip()
+
+
+class MinifyingLoader(BaseLoader):
+    """Wrap a template loader so every source is minified before it is compiled"""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = self.loader.get_source(environment, template)
+        return minify_html(source), filename, uptodate
+
+    def list_templates(self):
+        return self.loader.list_templates()
+
+
+class Fragments:
+    """Static page fragments, rendered once"""
+
+    def __init__(self, env):
+        self.head = Markup(env.get_template(FRAGMENTS_DIR + 'head.html').render())
+        options = env.get_template(FRAGMENTS_DIR + 'blood_type_options.html')
+        self._blood_type_options = {
+            selected: Markup(options.render(blood_types=BLOOD_TYPES, selected=selected))
+            for selected in (None, *BLOOD_TYPES)
+        }
+
+    def blood_type_options(self, selected=None):
+        """The blood type <option> list with selected (if a known blood type) preselected"""
+        return self._blood_type_options.get(selected, self._blood_type_options[None])
+
+
+def init_app(app):
+    """Install the minifying loader and bytecode cache, render fragments and compile every template"""
+    env = app.jinja_env
+    if app.config["TEMPLATE_MINIFY"]:
+        env.loader = MinifyingLoader(env.loader)
+    # No directory means a per-user directory under the system temp dir
+    env.bytecode_cache = FileSystemBytecodeCache(app.config["TEMPLATE_CACHE_DIR"] or None)
+
+    fragments = Fragments(env)
+    env.globals['fragments'] = fragments
+    templates = [name for name in env.list_templates()
+                 if name.endswith('.html') and not name.startswith(FRAGMENTS_DIR)]
+    for name in templates:
+        env.get_template(name)
+    app.extensions['rendering'] = fragments
+    return templates